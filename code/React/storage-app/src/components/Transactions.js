@@ -6,8 +6,6 @@ import Toast from 'react-bootstrap/Toast';
 
 const Transactions = () => {
     const [transactions, setTransactions] = useState([]);
-    const [products, setProducts] = useState([]);
-    const [users, setUsers] = useState([]);
     const [productSearchTerm, setProductSearchTerm] = useState('');
     const [userSearchTerm, setUserSearchTerm] = useState('');
     const { loggedInUser, handleContextLogin, isAdmin, setLoggedInUser } = useContext(AuthContext);
@@ -29,23 +27,7 @@ const Transactions = () => {
             setTransactions(response.data);
         };
 
-        const fetchProducts = async () => {
-            const response = await api.get('/get_products/');
-            setProducts(response.data);
-        };
-
-        const fetchUsers = async () => {
-            if (isAdmin) {
-                const response = await api.get('/get_users/');
-                setUsers(response.data);
-            } else {
-                setUsers([loggedInUser]);
-            }
-        };
-
         fetchTransactions();
-        fetchProducts();
-        fetchUsers();
     }, [loggedInUser]);
 
 
@@ -198,8 +180,8 @@ const Transactions = () => {
                 {sortedTransactions.map((transaction) => (
                     <tr key={transaction.id}>
                         <td>{transaction.id}</td>
-                        <td>{products.find(product => product.id === transaction.product_id)?.name}</td>
-                        <td>{users.find(user => user.id === transaction.user_id)?.username}</td>
+                        <td>{transaction.product_name}</td>
+                        <td>{transaction.user_name}</td>
                         <td>{transaction.quantity}</td>
                         <td>{transaction.price}</td>
                         <td>{transaction.currency}</td>
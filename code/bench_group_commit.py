@@ -0,0 +1,65 @@
+import sys
+sys.path.append("database")
+from database.db_handler_async import AsyncDatabaseHandler, AsyncDatabaseConnect, apply_transaction_batch
+from database.db_lifespan import group_commit
+from database.db_classes import *
+from sqlalchemy import event
+import asyncio
+import time
+
+#python bench_group_commit.py
+# A burst of concurrent create_transaction calls, one commit each versus group commit.
+# Writes to the configured database (the test database in test mode).
+
+CALLS = 2000
+CONCURRENCY = 200
+
+async def setup():
+    suffix = time.time_ns()
+    async with AsyncDatabaseHandler("Category") as db_h:
+        await db_h.create(name=f"bench_group_commit_{suffix}")
+    async with AsyncDatabaseHandler("Product") as db_h:
+        product = await db_h.create(name=f"bench_group_commit_{suffix}", description=None, category_name=f"bench_group_commit_{suffix}", purchase_price=1.0, restock_price=1.0, currency="USD", quantity=CALLS * 2)
+    async with AsyncDatabaseHandler("User") as db_h:
+        user = await db_h.create(username=f"bench_group_commit_{suffix}", password="password", email=f"bench_{suffix}@test.com")
+    return dict(product_id=product.id, user_id=user.id, quantity=1, transaction_type="purchase", currency="usd")
+
+async def single_commit(kwargs):
+    # /create_transaction/ without group commit
+    async with AsyncDatabaseHandler("Transaction") as db_h:
+        await db_h.create(**kwargs)
+        await db_h.commit()
+
+async def run(name, create, kwargs):
+    commits = [0]
+    def count_commit(connection):
+        commits[0] += 1
+    event.listen(AsyncDatabaseConnect.shared_engine.sync_engine, "commit", count_commit)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def call():
+        async with semaphore:
+            await create(kwargs)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(CALLS)))
+    seconds = time.perf_counter() - started
+    event.remove(AsyncDatabaseConnect.shared_engine.sync_engine, "commit", count_commit)
+    print(f"{name:<8} {CALLS / seconds:8.1f} transactions/s   {commits[0] / seconds:8.1f} commits/s   {commits[0]:6d} commits")
+
+async def main():
+    await AsyncDatabaseConnect.init_engine()
+    try:
+        kwargs = await setup()
+        await run("single", single_commit, kwargs)
+        await group_commit.start(apply_transaction_batch, enabled=True)
+        try:
+            await run("grouped", lambda kwargs: group_commit.submit(**kwargs), kwargs)
+            print(f"grouped  {group_commit.items / group_commit.batches:8.1f} calls per batch")
+        finally:
+            await group_commit.stop()
+    finally:
+        await AsyncDatabaseConnect.dispose_engine()
+
+if __name__ == "__main__":
+    asyncio.run(main())
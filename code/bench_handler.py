@@ -0,0 +1,47 @@
+import sys
+sys.path.append("database")
+from database.db_handler_async import AsyncDatabaseHandler, Service
+from database.db_classes import *
+import database.db_classes as db_classes
+import inspect
+import timeit
+
+#python bench_handler.py
+# Handler construction and service dispatch, no database needed
+
+N = 100000
+
+class LegacyHandler():
+    # Construction as it was: rebuild the type map from db_classes for every handler
+    def __init__(self, item_type=None):
+        self.db_connect = None
+        self.session = None
+        self.item_type = item_type.lower() if item_type else None
+        all_classes = [cls for name, cls in inspect.getmembers(db_classes, inspect.isclass)]
+        self.type_map = {cls.__name__.lower(): cls for cls in all_classes}
+        self.service = Service(None, self)
+        self.after_commit = []
+
+    def service_method(self, operation, item_type_lower):
+        # Dispatch as it was: format the method name and probe the Service for it
+        if hasattr(self.service, f"{operation}_{item_type_lower}"):
+            return getattr(self.service, f"{operation}_{item_type_lower}")
+        return None
+
+def report(name, legacy, current):
+    print(f"{name:<28} legacy {legacy / N * 1e6:8.3f} us   registry {current / N * 1e6:8.3f} us   {legacy / current:6.1f}x")
+
+def main():
+    legacy = timeit.timeit(lambda: LegacyHandler("Product"), number=N)
+    current = timeit.timeit(lambda: AsyncDatabaseHandler("Product"), number=N)
+    report("construct handler", legacy, current)
+
+    legacy_handler = LegacyHandler("Product")
+    handler = AsyncDatabaseHandler("Product")
+    for operation, instance in [('create', Product()), ('delete_by_id', Product()), ('update', Transaction())]:
+        legacy = timeit.timeit(lambda: legacy_handler.service_method(operation, type(instance).__name__.lower()), number=N)
+        current = timeit.timeit(lambda: handler.service_method(operation, type(instance).__name__.lower()), number=N)
+        report(f"dispatch {operation} {type(instance).__name__}", legacy, current)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import sys
+sys.path.append("database")
+from database.db_lifespan import passwords
+from werkzeug.security import generate_password_hash, check_password_hash
+import asyncio
+import time
+
+#python bench_login.py
+# Concurrent password checks as /login_user/ does them, with a ticker measuring event loop lag.
+# No database needed, the password check is the part that blocks the loop.
+
+LOGINS = 64
+CONCURRENCY = 16
+TICK = 0.005
+
+async def ticker(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - started - TICK)
+
+async def inline_verify(password_hash, password):
+    # The old login path, check_password_hash called straight from the endpoint
+    return check_password_hash(password_hash, password)
+
+async def run(name, verify, password_hash):
+    lags = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def login():
+        async with semaphore:
+            assert await verify(password_hash, "password")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(LOGINS)))
+    seconds = time.perf_counter() - started
+    stop.set()
+    await tick_task
+
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    worst = lags[-1] if lags else 0.0
+    print(f"{name:<8} {LOGINS / seconds:8.1f} logins/s   loop lag p99 {p99 * 1000:8.2f} ms   max {worst * 1000:8.2f} ms")
+
+async def main():
+    password_hash = generate_password_hash("password")
+    await run("inline", inline_verify, password_hash)
+    passwords.start()
+    try:
+        await run("pool", passwords.verify, password_hash)
+    finally:
+        passwords.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+import asyncio
+
+# Marker telling the collector task to handle what it has and exit
+STOP = object()
+
+class BatchCollector:
+    # Items put on the queue are taken off in batches by one background task. A batch is handed to
+    # flush(batch) once it has max_batch items or window seconds have passed since its first item.
+    # Used by the log writer and group commit, subclasses implement flush
+    def __init__(self):
+        self.queue = None
+        self.task = None
+        self.accepting = False
+
+    @property
+    def running(self):
+        return self.accepting and self.task is not None and not self.task.done()
+
+    def start_collecting(self, max_batch, window, queue_size=0):
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.accepting = True
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.accepting = False
+        # Everything queued before the marker is still flushed
+        if not self.task.done():
+            await self.queue.put(STOP)
+        await self.task
+        self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self.flush(batch)
+
+    async def flush(self, batch):
+        raise NotImplementedError
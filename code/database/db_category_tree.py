@@ -0,0 +1,109 @@
+from db_classes import Category
+from sqlalchemy import select
+import asyncio
+import logging
+
+# Placeholder category, hidden from reads like filter_deleted_references does
+DELETED_CATEGORY_NAME = 'deleted_category'
+
+class CategoryTree:
+    def __init__(self):
+        self.loaded = False
+        self.version = 0
+        self.lock = asyncio.Lock()
+        self.by_id = {}
+        self.by_name = {}
+        self.children = {}
+        self.paths = {}
+        self.descendants = {}
+
+    async def load(self, session):
+        version = self.version
+        result = await session.execute(select(Category.id, Category.name, Category.description, Category.parent_id))
+        self.build([dict(row) for row in result.mappings()])
+        # An invalidation that raced the load means the rows may already be stale
+        self.loaded = version == self.version
+
+    async def ensure_loaded(self, session):
+        if not self.loaded:
+            async with self.lock:
+                if not self.loaded:
+                    await self.load(session)
+        return self
+
+    async def watch(self, sessionmaker, interval):
+        # Writes from other worker processes only reach this tree through the periodic reload
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with sessionmaker() as session:
+                    await self.load(session)
+            except Exception as e:
+                logging.error(f"Failed to reload category tree: {e}")
+
+    def invalidate(self):
+        self.version += 1
+        self.loaded = False
+
+    def build(self, rows):
+        by_id = {row["id"]: row for row in sorted(rows, key=lambda row: row["id"])}
+        by_name = {row["name"]: row for row in by_id.values()}
+        children = {id: [] for id in by_id}
+        roots = []
+        for id, row in by_id.items():
+            if row["parent_id"] in by_id and row["parent_id"] != id:
+                children[row["parent_id"]].append(id)
+            else:
+                roots.append(id)
+
+        # Ancestor paths top-down, a category's path ends with itself
+        paths = {}
+        stack = [(id, (id,)) for id in roots]
+        order = []
+        while stack:
+            id, path = stack.pop()
+            if id in paths:
+                continue
+            paths[id] = path
+            order.append(id)
+            stack.extend((child, path + (child,)) for child in children[id])
+
+        # Descendant sets bottom-up, reverse of the top-down order visits children first
+        descendants = {}
+        for id in reversed(order):
+            below = set()
+            for child in children[id]:
+                below.add(child)
+                below |= descendants.get(child, frozenset())
+            descendants[id] = frozenset(below)
+
+        # Swap everything in at once so readers never see a half built tree
+        self.by_id, self.by_name, self.children, self.paths, self.descendants = by_id, by_name, children, paths, descendants
+
+    def visible(self, row):
+        return row is not None and row["name"] != DELETED_CATEGORY_NAME
+
+    def get(self, id):
+        row = self.by_id.get(id)
+        return row if self.visible(row) else None
+
+    def get_by_name(self, name):
+        row = self.by_name.get(name)
+        return row if self.visible(row) else None
+
+    def all(self):
+        return [row for row in self.by_id.values() if self.visible(row)]
+
+    def subcategories(self, id):
+        return [self.by_id[child] for child in self.children.get(id, []) if self.visible(self.by_id[child])]
+
+    def path(self, id):
+        # Breadcrumb from the top-level category down to this one
+        return [self.by_id[ancestor] for ancestor in self.paths.get(id, ())]
+
+    def subtree_ids(self, id):
+        if id not in self.by_id:
+            return frozenset()
+        return self.descendants.get(id, frozenset()) | {id}
+
+category_tree = CategoryTree()
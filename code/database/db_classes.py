@@ -1,30 +1,22 @@
 import uuid
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Date, Text, Index
 from sqlalchemy.orm import declarative_base, relationship, validates
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from db_settings import get_settings
 import re
-import os
-import json
 
-# Get the directory of the current script
-script_dir = os.path.dirname(os.path.abspath(__file__))
-
-# Construct the path to the file
-file_path = os.path.join(script_dir, '..', 'data', 'currencies.json')
-
-with open(file_path, 'r') as f:
-    currencies_data = json.load(f)
-
-ALLOWED_CURRENCIES = currencies_data['allowed_currencies']
+# Snapshot for importers, validation reads the live settings so currency changes apply without a restart
+ALLOWED_CURRENCIES = get_settings().allowed_currencies
 ALLOWED_TRANSACTION_TYPES = ['purchase', 'refund', 'restock']
 ALLOWED_ADMIN_STATUSES = ['none', 'regular', 'full']
 
 def validate_currency(currency):
     currency = currency.lower()
-    if currency not in ALLOWED_CURRENCIES:
-        raise ValueError(f"Invalid currency '{currency}', allowed currencies are {ALLOWED_CURRENCIES}")
+    allowed_currencies = get_settings().allowed_currencies
+    if currency not in allowed_currencies:
+        raise ValueError(f"Invalid currency '{currency}', allowed currencies are {list(allowed_currencies)}")
     return currency
 
 Base = declarative_base()
@@ -48,7 +40,7 @@ class Log(BaseModel):
     
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     uuid = Column(String(36), default=lambda: str(uuid.uuid4()), unique=True, nullable=False)
-    date = Column(DateTime, default=datetime.now(), nullable=False)
+    date = Column(DateTime, default=datetime.now, nullable=False, index=True)
     func = Column(String(100), nullable=False)
     kwargs = Column(Text)
     status = Column(String(10), nullable=False)
@@ -66,8 +58,8 @@ class Product(BaseModel):
     restock_price = Column(Float)
     currency = Column(String(3), nullable=False)
     quantity = Column(Integer)
-    creation_date = Column(DateTime, default=datetime.now(), nullable=False)
-    changed_date = Column(DateTime, default=datetime.now(), nullable=False)
+    creation_date = Column(DateTime, default=datetime.now, nullable=False)
+    changed_date = Column(DateTime, default=datetime.now, nullable=False)
     
     category = relationship('Category', back_populates='products')
 
@@ -105,15 +97,20 @@ class Transaction(BaseModel):
     uuid = Column(String(36), default=lambda: str(uuid.uuid4()), unique=True, nullable=False)
     product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    date = Column(DateTime, default=datetime.now(), nullable=False)
+    date = Column(DateTime, default=datetime.now, nullable=False, index=True)
     price = Column(Float, nullable=False)
     currency = Column(String(3), nullable=False)
+    # price in the base_currency from the config, converted once when the row is written
+    base_price = Column(Float)
     quantity = Column(Integer, nullable=False)
     transaction_type = Column(String(20), nullable=False)
 
     product = relationship('Product')
     user = relationship('User')
 
+    # Covers the report sums, a date range of one type is read from the index alone
+    __table_args__ = (Index('ix_transactions_type_date_base_price', 'transaction_type', 'date', 'base_price'),)
+
     @validates('transaction_type')
     def validate_transaction_type(self, key, transaction_type):
         if transaction_type not in ALLOWED_TRANSACTION_TYPES:
@@ -122,7 +119,7 @@ class Transaction(BaseModel):
     
     @validates('quantity')
     def validate_quantity(self, key, quantity):
-        if quantity < 0:
+        if quantity <= 0:
             raise ValueError("Quantity must be positive")
         return quantity
     
@@ -130,6 +127,79 @@ class Transaction(BaseModel):
     def validate_currency(self, key, currency):
         return validate_currency(currency)
 
+class CurrencyRate(BaseModel):
+    # A rate applies from effective_from until the next row for the same currency, rows are only ever added
+    __tablename__ = 'currency_rates'
+
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    currency = Column(String(3), nullable=False)
+    rate = Column(Float, nullable=False) # Units of the currency per USD, like conversion_currencies in currencies.json
+    effective_from = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (Index('ix_currency_rates_currency_effective_from', 'currency', 'effective_from', unique=True),)
+
+    @validates('currency')
+    def validate_currency(self, key, currency):
+        return validate_currency(currency)
+
+    @validates('rate')
+    def validate_rate(self, key, rate):
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        return rate
+
+class TransactionDailySummary(BaseModel):
+    # Rollup of the transactions per day, maintained in the same DB transaction as every transaction write
+    __tablename__ = 'transaction_daily_summary'
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    transaction_type = Column(String(20), primary_key=True)
+    currency = Column(String(3), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    price = Column(Float, nullable=False, default=0)
+    base_price = Column(Float, nullable=False, default=0)
+
+    # Rolling product activity reads a few weeks of one product's days
+    __table_args__ = (Index('ix_transaction_daily_summary_product_id_day', 'product_id', 'day'),)
+
+class ProductActivity(BaseModel):
+    # Lifetime totals per product and transaction type, maintained like the daily summary
+    __tablename__ = 'product_activity'
+
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    transaction_type = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    base_price = Column(Float, nullable=False, default=0)
+    last_date = Column(DateTime)
+
+class UserActivity(BaseModel):
+    # Lifetime totals per user and transaction type, maintained like the daily summary
+    __tablename__ = 'user_activity'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    transaction_type = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    base_price = Column(Float, nullable=False, default=0)
+    last_date = Column(DateTime)
+
+class UserDailyActivity(BaseModel):
+    # Per user and day, the rolling windows of user activity are summed from these
+    __tablename__ = 'user_daily_activity'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    day = Column(Date, primary_key=True)
+    transaction_type = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    base_price = Column(Float, nullable=False, default=0)
+
+    # Customer leaderboards read every user's days of the current period
+    __table_args__ = (Index('ix_user_daily_activity_day', 'day'),)
+
 class User(BaseModel):
     __tablename__ = 'users'
     
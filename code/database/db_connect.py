@@ -2,9 +2,8 @@ from sqlalchemy import create_engine, MetaData
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from contextlib import asynccontextmanager
-import json
+from db_settings import get_settings
 import asyncio
-import os
 
 class SingletonDatabaseConnect:
     instance = None
@@ -28,79 +27,112 @@ class SingletonDatabaseConnect:
 
     @classmethod
     def connect_from_config(cls):
-        # Get the directory of the current script
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-
-        # Construct the path to the file
-        file_path_secrets = os.path.join(script_dir, '..', 'data', 'secrets.json')
-        file_path_config = os.path.join(script_dir, '..', 'data', 'config_async.json')
-
-        with open(file_path_secrets, 'r') as f:
-            secrets = json.load(f)
-
-        with open(file_path_config, 'r') as f:
-            config = json.load(f)
-
-        adapter = config['adapter'] 
-        test_mode = config['test_mode'].lower() == "true"
-        username = secrets['username']
-        password = secrets['password']
-        hostname = secrets['hostname']
-
-        if test_mode and 'test_db_name' in secrets:
-            database_name = secrets['test_db_name']
-        else:
-            database_name = secrets['db_name']
-
-        db_url = f"{adapter}://{username}:{password}@{hostname}/{database_name}"
-        db_connect = cls(db_url)
+        settings = get_settings()
+        db_connect = cls(settings.db_url(settings.sync_adapter))
 
         return db_connect
 
 class AsyncDatabaseConnect:
-    def __init__(self, db_url):
-        self.engine = create_async_engine(
-            db_url,
-            connect_args={'connect_timeout': 5}
-            #,echo=True
-        )
-        self.sessionmaker = sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+    # Process-wide pooled engine, created once by init_engine() at startup
+    shared_engine = None
+    shared_sessionmaker = None
+    # Second pool for read-only handlers, its connections stay in autocommit
+    shared_readonly_engine = None
+    shared_readonly_sessionmaker = None
+
+    def __init__(self, db_url=None, readonly=False, **engine_options):
+        if db_url is None:
+            # Borrow the shared engine, the pool outlives this instance
+            if readonly:
+                self.engine = AsyncDatabaseConnect.shared_readonly_engine
+                self.sessionmaker = AsyncDatabaseConnect.shared_readonly_sessionmaker
+            else:
+                self.engine = AsyncDatabaseConnect.shared_engine
+                self.sessionmaker = AsyncDatabaseConnect.shared_sessionmaker
+            self.owns_engine = False
+        else:
+            if readonly:
+                engine_options = {**engine_options, **self.readonly_options()}
+            self.engine = create_async_engine(
+                db_url,
+                connect_args={'connect_timeout': 5},
+                **engine_options
+                #,echo=True
+            )
+            self.sessionmaker = sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+            self.owns_engine = True
+        self.session = None
 
     async def get_new_session(self):
         self.session = self.sessionmaker()
         return self.session
 
     async def close(self):
-        await self.session.close()
-        await self.engine.dispose()
-            
-    @staticmethod
-    async def connect_from_config():
-        # Get the directory of the current script
-        script_dir = os.path.dirname(os.path.abspath(__file__))
+        if self.session is not None:
+            await self.session.close()
+        # Only dispose engines created for this connection, never the shared pool
+        if self.owns_engine:
+            await self.engine.dispose()
 
-        # Construct the path to the file
-        file_path_secrets = os.path.join(script_dir, '..', 'data', 'secrets.json')
-        file_path_config = os.path.join(script_dir, '..', 'data', 'config_async.json')
+    @staticmethod
+    def pool_options(settings):
+        return {
+            'pool_size': settings.pool_size,
+            'max_overflow': settings.max_overflow,
+            'pool_recycle': settings.pool_recycle,
+            'pool_pre_ping': settings.pool_pre_ping,
+        }
 
-        with open(file_path_secrets, 'r') as f:
-            secrets = json.load(f)
+    @staticmethod
+    def readonly_options():
+        # Autocommit connections never hold a transaction open, so nothing to reset when they go back to the pool
+        return {
+            'isolation_level': 'AUTOCOMMIT',
+            'pool_reset_on_return': None,
+        }
 
-        with open(file_path_config, 'r') as f:
-            config = json.load(f)
+    @classmethod
+    async def init_engine(cls):
+        # Called once per worker process from the FastAPI lifespan
+        if cls.shared_engine is None:
+            # Settings reloads don't rebuild the pool, URL changes need a restart
+            settings = get_settings()
+            cls.shared_engine = create_async_engine(
+                settings.db_url(),
+                connect_args={'connect_timeout': 5},
+                **cls.pool_options(settings)
+            )
+            cls.shared_sessionmaker = sessionmaker(cls.shared_engine, expire_on_commit=False, class_=AsyncSession)
+            # Read-only sessions get a pool of their own that stays in autocommit, switching a shared
+            # connection per checkout and resetting it on return would cost more round trips than the
+            # COMMIT it saves. Sized separately, the worker's budget is pool_size + readonly_pool_size
+            cls.shared_readonly_engine = create_async_engine(
+                settings.db_url(),
+                connect_args={'connect_timeout': 5},
+                **dict(cls.pool_options(settings), pool_size=settings.readonly_pool_size, max_overflow=settings.readonly_max_overflow),
+                **cls.readonly_options()
+            )
+            cls.shared_readonly_sessionmaker = sessionmaker(cls.shared_readonly_engine, expire_on_commit=False, class_=AsyncSession)
+        return cls.shared_engine
 
-        adapter = config['adapter'] 
-        test_mode = config['test_mode'].lower() == "true"
-        username = secrets['username']
-        password = secrets['password']
-        hostname = secrets['hostname']
+    @classmethod
+    async def dispose_engine(cls):
+        # Called once at shutdown, closes every pooled connection
+        if cls.shared_engine is not None:
+            await cls.shared_engine.dispose()
+            cls.shared_engine = None
+            cls.shared_sessionmaker = None
+        if cls.shared_readonly_engine is not None:
+            await cls.shared_readonly_engine.dispose()
+            cls.shared_readonly_engine = None
+            cls.shared_readonly_sessionmaker = None
 
-        if test_mode and 'test_db_name' in secrets:
-            database_name = secrets['test_db_name']
-        else:
-            database_name = secrets['db_name']
+    @staticmethod
+    async def connect_from_config(readonly=False):
+        if AsyncDatabaseConnect.shared_engine is not None:
+            return AsyncDatabaseConnect(readonly=readonly)
 
-        db_url = f"{adapter}://{username}:{password}@{hostname}/{database_name}"
-        db_connect = AsyncDatabaseConnect(db_url)
+        # No shared engine (scripts, tests), fall back to a short lived engine
+        db_connect = AsyncDatabaseConnect(get_settings().db_url(), readonly=readonly)
 
-        return db_connect
\ No newline at end of file
+        return db_connect
@@ -0,0 +1,80 @@
+from db_classes import CurrencyRate
+from db_settings import get_settings
+from sqlalchemy import select, func, case
+from bisect import bisect_right
+from datetime import datetime
+import asyncio
+import logging
+
+class CurrencyRates:
+    # Process-local copy of currency_rates. "Rate of X at T" is a bisect over that currency's
+    # effective_from times, so pricing and reports never query the database for rates
+    def __init__(self):
+        self.starts = {}
+        self.rates = {}
+        self.last_id = None
+        self.changed = asyncio.Event()
+
+    async def load(self, session):
+        result = await session.execute(
+            select(CurrencyRate.id, CurrencyRate.currency, CurrencyRate.rate, CurrencyRate.effective_from)
+            .order_by(CurrencyRate.currency, CurrencyRate.effective_from)
+        )
+        starts, rates, last_id = {}, {}, None
+        for row in result:
+            starts.setdefault(row.currency, []).append(row.effective_from)
+            rates.setdefault(row.currency, []).append(row.rate)
+            last_id = row.id if last_id is None else max(last_id, row.id)
+        # Swap everything in at once so lookups never see half loaded rates
+        self.starts, self.rates, self.last_id = starts, rates, last_id
+
+    async def watch(self, sessionmaker, interval):
+        # Wakes up when a rate is added in this process, otherwise polls for rates added by other workers
+        while True:
+            try:
+                await asyncio.wait_for(self.changed.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+            try:
+                async with sessionmaker() as session:
+                    # Rates are only ever inserted, a new max id means there's something to load
+                    if await session.scalar(select(func.max(CurrencyRate.id))) != self.last_id:
+                        await self.load(session)
+            except Exception as e:
+                logging.error(f"Failed to reload currency rates: {e}")
+
+    def invalidate(self):
+        self.changed.set()
+
+    def rate(self, currency, at=None):
+        starts = self.starts.get(currency)
+        if starts:
+            index = bisect_right(starts, at or datetime.now()) - 1
+            if index >= 0:
+                return self.rates[currency][index]
+        # Nothing in the table for that time, the rates from currencies.json apply
+        return get_settings().conversion_rates[currency]
+
+    def rates_at(self, at=None):
+        at = at or datetime.now()
+        return {currency: self.rate(currency, at) for currency in get_settings().conversion_rates}
+
+currency_rates = CurrencyRates()
+
+def base_currency():
+    return get_settings().base_currency
+
+def to_base(amount, currency, rates=None):
+    # Amount in the configured base currency, rates are units per USD like in currencies.json
+    rates = rates or currency_rates.rates_at()
+    return amount * rates[base_currency()] / rates[currency]
+
+def from_base(amount, currency, rates=None):
+    rates = rates or currency_rates.rates_at()
+    return amount * rates[currency] / rates[base_currency()]
+
+def base_price_expression(price_column, currency_column):
+    # SQL counterpart of to_base at the current rates, price * base rate / CASE currency WHEN ... END
+    rates = currency_rates.rates_at()
+    return price_column * rates[base_currency()] / case(rates, value=currency_column)
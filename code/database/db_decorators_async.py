@@ -1,5 +1,6 @@
 from functools import wraps
 from db_classes import Log
+from db_log_writer import log_writer
 from sqlalchemy.exc import SQLAlchemyError
 import json
 
@@ -14,13 +15,14 @@ def log_to_db(func):
         
         try:
             result = await func(self, *args, **kwargs)
-            self.session.add(Log(func=func.__name__, kwargs=kwargs_str, status=f"OK", message=message))
-            await self.session.commit()
+            # The request's own commit happens in the handler, OK is only logged once it succeeded
+            log_writer.enqueue_on_commit(self.db_handler, func.__name__, kwargs_str, "OK", message)
             return result
         except Exception as e:
-            log_session = await self.db_handler.db_connect.get_new_session()
-            log_session.add(Log(func=func.__name__, kwargs=kwargs_str, status="FAIL", message=f"{str(e)}"))
-            await log_session.commit()
+            if not await log_writer.enqueue(func.__name__, kwargs_str, "FAIL", f"{str(e)}"):
+                log_session = await self.db_handler.db_connect.get_new_session()
+                log_session.add(Log(func=func.__name__, kwargs=kwargs_str, status="FAIL", message=f"{str(e)}"))
+                await log_session.commit()
             raise
     return wrapper
 
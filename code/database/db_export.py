@@ -0,0 +1,45 @@
+from datetime import datetime
+import csv
+import io
+import json
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't serialize {type(value).__name__}")
+
+async def ndjson_lines(rows, rows_per_chunk=500):
+    # Rows are joined into larger chunks so the response isn't one write per row
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(dict(row), default=json_default))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+async def csv_lines(rows, columns, rows_per_chunk=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    async for row in rows:
+        writer.writerow([row[column] for column in columns])
+        count += 1
+        if count >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+def export_lines(rows, export_format, columns):
+    if export_format == 'csv':
+        return csv_lines(rows, columns)
+    return ndjson_lines(rows)
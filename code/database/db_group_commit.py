@@ -0,0 +1,50 @@
+from db_settings import get_settings
+from db_batching import BatchCollector
+import asyncio
+import logging
+
+class GroupCommitter(BatchCollector):
+    # Concurrent writes are collected for a few milliseconds and applied in one DB transaction,
+    # so a burst of requests pays for one commit instead of one each
+    def __init__(self):
+        super().__init__()
+        self.apply_batch = None
+        self.batches = 0
+        self.items = 0
+
+    async def start(self, apply_batch, enabled=None):
+        # apply_batch(list of kwargs) applies and commits a batch, returning one result or exception per item
+        settings = get_settings()
+        if not (settings.group_commit_enabled if enabled is None else enabled):
+            return
+        self.apply_batch = apply_batch
+        self.start_collecting(settings.group_commit_max_batch, settings.group_commit_window_ms / 1000)
+
+    async def submit(self, **kwargs):
+        # Waits for the batch holding this call to commit, then returns its result or raises its error
+        if not self.running:
+            # Once stop() has queued its marker nothing would ever apply this call, callers write directly instead
+            raise RuntimeError("Group commit is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kwargs, future))
+        return await future
+
+    async def flush(self, batch):
+        try:
+            outcomes = await self.apply_batch([kwargs for kwargs, future in batch])
+        except Exception as e:
+            # The shared commit failed, nothing in the batch was written
+            logging.error(f"Failed to apply a batch of {len(batch)} writes: {e}")
+            outcomes = [e] * len(batch)
+        self.batches += 1
+        self.items += len(batch)
+        for (kwargs, future), outcome in zip(batch, outcomes):
+            # A caller that went away still had its write applied, there's just no one to tell
+            if future.done():
+                continue
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+group_commit = GroupCommitter()
@@ -2,16 +2,51 @@ import db_classes
 from db_classes import *
 from db_classes import ALLOWED_CURRENCIES, ALLOWED_TRANSACTION_TYPES, ALLOWED_ADMIN_STATUSES
 from db_decorators_async import log_to_db
-from sqlalchemy import select, update, and_
+from sqlalchemy import select, update, insert, and_, or_, literal, func, true, case
+from sqlalchemy.exc import SQLAlchemyError
 from db_connect import AsyncDatabaseConnect
+from db_settings import get_settings
+from db_category_tree import category_tree
+from db_sentinels import sentinels
+from db_passwords import passwords
+from db_log_writer import log_writer
+from db_reports import transaction_report, parse_group_by, top_report, top_reports
+from db_rollups import record_transactions, reassign_rollups, transaction_fields, activity
+from db_currency import to_base, currency_rates
+import asyncio
 import inspect
+import base64
+import json
+import uuid
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-file_path = os.path.join(script_dir, '..', 'data', 'currencies.json')
-with open(file_path, 'r') as f:
-    currencies_data = json.load(f)
+# Snapshot for importers, create_transaction reads the live settings
+CURRENCY_CONVERSION_RATES = dict(get_settings().conversion_rates)
 
-CURRENCY_CONVERSION_RATES = dict(currencies_data['conversion_currencies'])
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Tablename -> columns a list endpoint may be sorted and paged on. The last sort value goes back
+# to the client in the cursor, so only columns that are safe to show belong here
+SORT_KEYS = {
+    'users': ('id', 'username'),
+    'categories': ('id', 'name'),
+    'products': ('id', 'name', 'creation_date', 'changed_date'),
+    'transactions': ('id', 'date', 'price', 'quantity', 'transaction_type'),
+    'logs': ('id', 'date', 'func', 'status'),
+}
+
+# Cursors are opaque to clients: base64 of [sort_key, descending, last sort value, last id]
+def encode_cursor(sort_key, descending, sort_value, id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([sort_key, descending, sort_value, id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        sort_key, descending, sort_value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    return sort_key, descending, sort_value, id
 
 class Validator:
     @staticmethod
@@ -55,9 +90,10 @@ class Validator:
             category = await db_handler.get_by(Category, name=category_name)
 
         if category is None:
-            category = await db_handler.get_by(Category, id=1)  # Use the default "Unknown" category
+            # Use the default "Unknown" category, looked up by name since the sentinel rows may have taken id 1
+            category = await db_handler.get_by(Category, name="Unknown")
             if category is None:
-                raise ValueError("No category found with ID 1")
+                raise ValueError("No default \"Unknown\" category found")
 
         return category
     
@@ -85,22 +121,36 @@ class Validator:
 
     @staticmethod
     async def validate_transaction(data_dict, db_handler):
-        product_id = data_dict.get("product_id")
-        product = await db_handler.get_by(Product, id=product_id)
-        if product is None:
-            raise ValueError(f"No product found with ID {product_id}")
-
+        # Product existence and stock are checked by the conditional stock update itself
         transaction_type = data_dict.get("transaction_type")
         if transaction_type not in ALLOWED_TRANSACTION_TYPES:
             raise ValueError("Invalid transaction type")
         
         currency = data_dict.get("currency")
-        if currency not in ALLOWED_CURRENCIES:
+        if currency not in get_settings().allowed_currencies:
             raise ValueError("Invalid currency")
 
         quantity = data_dict.get("quantity")
-        if transaction_type == 'purchase' and product.quantity < quantity:
-            raise ValueError("Not enough stock for purchase")
+        if quantity is None or quantity <= 0:
+            raise ValueError("Quantity must be positive")
+
+# Sign of the stock change for each transaction type
+STOCK_DIRECTIONS = {'purchase': -1, 'refund': 1, 'restock': 1}
+
+def price_transaction(product, quantity, transaction_type, currency):
+    # product is anything with purchase_price, restock_price and currency, an ORM object or a row
+    if transaction_type == 'purchase':
+        price = product.purchase_price * quantity
+    elif transaction_type == 'refund':
+        price = -product.purchase_price * quantity
+    elif transaction_type == 'restock':
+        price = -product.restock_price * quantity
+
+    # Convert price to the target currency at the rates in effect now
+    conversion_rates = currency_rates.rates_at()
+    conversion_rate_product = conversion_rates[product.currency]
+    conversion_rate_transaction = conversion_rates[currency]
+    return price * conversion_rate_transaction / conversion_rate_product
 
 class Service:
     def __init__(self, session, db_handler):
@@ -114,7 +164,7 @@ class Service:
         user = User()
         user.set_username(username)
         user.set_email(email)
-        user.set_password(password)
+        user.password = await passwords.hash(password)
         await self.db_handler.add(user)
         return user
     
@@ -126,7 +176,7 @@ class Service:
         user = AdminUser()
         user.set_username(username)
         user.set_email(email)
-        user.set_password(password)
+        user.password = await passwords.hash(password)
         user.admin_status = admin_status
         await self.db_handler.add(user)
         return user
@@ -161,6 +211,7 @@ class Service:
             parent_id=parent.id if parent else None
         )
         await self.db_handler.add(category)
+        self.db_handler.on_commit(category_tree.invalidate)
         return category
     
     @log_to_db
@@ -191,67 +242,70 @@ class Service:
         return product
     
     @log_to_db
-    async def delete_by_id_product(self, product):
-        # Get the "deleted product" reference
-        stmt = select(Product).where(Product.name == 'deleted_product')
-        result = await self.db_handler.session.execute(stmt)
-        deleted_product = result.scalars().first()
-
-        if not deleted_product:
-            # If the "deleted product" doesn't exist, create it
-            deleted_product = Product(name='deleted_product', description='This is a placeholder for a deleted product', currency='USD')
-            await self.db_handler.add(deleted_product)
-            await self.db_handler.commit()  # Commit the transaction to save the new product
-
-        # Update transactions that reference the product to reference the "deleted product" instead
-        transactions = await self.db_handler.get_all_by(Transaction, product_id=product.id)
-        for transaction in transactions:
-            await self.db_handler.update(transaction, product_id=deleted_product.id)
+    async def create_currencyrate(self, currency, rate, effective_from=None):
+        # A new version of the rate, earlier rates stay for the time before effective_from
+        effective_from = datetime.fromisoformat(effective_from) if effective_from else datetime.now()
+        currency_rate = CurrencyRate(currency=currency, rate=rate, effective_from=effective_from)
+        await self.db_handler.add(currency_rate)
+        # Every worker's rate cache picks it up on its next poll, this one reloads right after the commit
+        self.db_handler.on_commit(currency_rates.invalidate)
+        return currency_rate
+
+    async def reassign_references(self, column, old_id, new_id, chunk_size=None):
+        # UPDATE ... SET column = :new WHERE column = :old, one statement however many rows reference old_id
+        stmt = update(column.class_).where(column == old_id).values({column.key: new_id}).execution_options(synchronize_session=False)
+        if not chunk_size:
+            result = await self.db_handler.session.execute(stmt)
+            return result.rowcount
+
+        # Chunked mode commits after every chunk so row locks are only held for one chunk at a time
+        stmt = stmt.with_dialect_options(mysql_limit=chunk_size)
+        reassigned = 0
+        while True:
+            result = await self.db_handler.session.execute(stmt)
+            await self.db_handler.commit()
+            reassigned += result.rowcount
+            if result.rowcount < chunk_size:
+                return reassigned
+
+    @log_to_db
+    async def delete_by_id_product(self, product, chunk_size=None):
+        # The "deleted product" id is cached at startup, no lookup per delete
+        deleted_product_id = await sentinels.get_or_create(self.db_handler, Product)
+
+        # Point transactions that reference the product at the "deleted product" instead
+        await self.reassign_references(Transaction.product_id, product.id, deleted_product_id, chunk_size)
+        await reassign_rollups(self.db_handler.session, 'product_id', product.id, deleted_product_id)
 
         # Now delete the product
         await self.db_handler.delete(product)
+        self.db_handler.on_commit(top_reports.invalidate)
 
     @log_to_db
-    async def delete_by_id_category(self, category):
-        # Get the "deleted category" reference
-        stmt = select(Category).where(Category.name == 'deleted_category')
-        result = await self.db_handler.session.execute(stmt)
-        deleted_category = result.scalars().first()
-
-        if not deleted_category:
-            # If the "deleted category" doesn't exist, create it
-            deleted_category = Category(name='deleted_category', description='This is a placeholder for a deleted category')
-            await self.db_handler.add(deleted_category)
-            await self.db_handler.commit()  # Commit the transaction to save the new category
-
-        # Update products that reference the category to reference the "deleted category" instead
-        products = await self.db_handler.get_all_by(Product, category_id=category.id)
-        for product in products:
-            await self.db_handler.update(product, category_id=deleted_category.id)
+    async def delete_by_id_category(self, category, chunk_size=None):
+        # The "deleted category" id is cached at startup, no lookup per delete
+        deleted_category_id = await sentinels.get_or_create(self.db_handler, Category)
+
+        # Point products that reference the category at the "deleted category" instead
+        await self.reassign_references(Product.category_id, category.id, deleted_category_id, chunk_size)
 
         # Now delete the category
         await self.db_handler.delete(category)
+        self.db_handler.on_commit(category_tree.invalidate)
+        self.db_handler.on_commit(top_reports.invalidate)
     
     @log_to_db
-    async def delete_by_id_user(self, user):
-        # Get the "deleted user" reference
-        stmt = select(User).where(User.username == 'deleted_user')
-        result = await self.db_handler.session.execute(stmt)
-        deleted_user = result.scalars().first()
-
-        if not deleted_user:
-            # If the "deleted user" doesn't exist, create it
-            deleted_user = User(username='deleted_user', email="a@a.com", password="deleted_user")
-            await self.db_handler.add(deleted_user)
-            await self.db_handler.commit()  # Commit the transaction to save the new user
-
-        # Update transactions that reference the user to reference the "deleted user" instead
-        transactions = await self.db_handler.get_all_by(Transaction, user_id=user.id)
-        for transaction in transactions:
-            await self.db_handler.update(transaction, user_id=deleted_user.id)
+    async def delete_by_id_user(self, user, chunk_size=None):
+        # The "deleted user" id is cached at startup, no lookup per delete
+        deleted_user_id = await sentinels.get_or_create(self.db_handler, User)
+
+        # Point transactions that reference the user at the "deleted user" instead
+        await self.reassign_references(Transaction.user_id, user.id, deleted_user_id, chunk_size)
+        await reassign_rollups(self.db_handler.session, 'user_id', user.id, deleted_user_id)
 
         # Now delete the user
         await self.db_handler.delete(user)
+        self.db_handler.on_commit(top_reports.invalidate)
     
     @log_to_db
     async def update_by_id_product(self, product, **kwargs):
@@ -261,12 +315,16 @@ class Service:
         # Validate and update the product
         await Validator.validate_update_product(kwargs, self.db_handler, existing_product=product)
         await self.db_handler.update(product, **kwargs)
+        # Category leaderboards count the product's sales under its new category
+        if 'category_id' in kwargs:
+            self.db_handler.on_commit(top_reports.invalidate)
 
         # If category_name was provided, update the product's category
         if category_name is not None:
             # Fetch the product's category and update its name
             category = await self.db_handler.get_by_id(Category, product.category_id)
             category.name = category_name
+            self.db_handler.on_commit(category_tree.invalidate)
             await self.db_handler.commit()
     
     @log_to_db
@@ -277,6 +335,7 @@ class Service:
         # Validate and update the category
         await Validator.validate_update_category(kwargs, self.db_handler, existing_category=category)
         await self.db_handler.update(category, **kwargs)
+        self.db_handler.on_commit(category_tree.invalidate)
 
         # If parent_name was provided, update the category's parent
         if parent_name is not None:
@@ -299,77 +358,524 @@ class Service:
         }
         await Validator.validate_transaction(data_dict, self.db_handler)
 
-        product = await self.db_handler.get_by(Product, id=product_id)
+        product = await self.db_handler.get_product_pricing(product_id)
+        if product is None:
+            raise ValueError(f"No product found with ID {product_id}")
 
-        if transaction_type == 'purchase':
-            product.quantity -= quantity
-            price = product.purchase_price * quantity
-        elif transaction_type == 'refund':
-            product.quantity += quantity
-            price = -product.purchase_price * quantity
-        elif transaction_type == 'restock':
-            product.quantity += quantity
-            price = -product.restock_price * quantity
+        # One conditional UPDATE, concurrent purchases can't oversell and no row lock is held in between
+        if not await self.db_handler.change_stock(product_id, STOCK_DIRECTIONS[transaction_type] * quantity):
+            raise ValueError("Not enough stock for purchase")
 
-        # Convert price to the target currency
-        conversion_rate_product = CURRENCY_CONVERSION_RATES[product.currency]
-        conversion_rate_transaction = CURRENCY_CONVERSION_RATES[currency]
-        price_in_target_currency = price * conversion_rate_transaction / conversion_rate_product
+        price_in_target_currency = price_transaction(product, quantity, transaction_type, currency)
 
         transaction = Transaction(
             product_id=product_id,
             user_id=user_id,
+            date=datetime.now(),
             price=price_in_target_currency,
+            base_price=to_base(price_in_target_currency, currency),
             quantity=quantity,
             transaction_type=transaction_type,
             currency=currency
         )
         await self.db_handler.add(transaction)
+        await self.db_handler.record_transactions([transaction_fields(transaction)])
         return transaction
 
+    @log_to_db
+    async def delete_by_id_transaction(self, transaction):
+        # Take the row back out of the daily summary before it goes
+        await self.db_handler.record_transactions([transaction_fields(transaction)], sign=-1)
+        await self.db_handler.session.delete(transaction)
+
+    @log_to_db
+    async def update_by_id_transaction(self, transaction, **kwargs):
+        # The summary loses the old values and gains the new ones
+        old_fields = transaction_fields(transaction)
+        new_fields = dict(old_fields, **{key: value for key, value in kwargs.items() if key in old_fields})
+        if new_fields["currency"] != old_fields["currency"] or new_fields["price"] != old_fields["price"]:
+            kwargs["base_price"] = new_fields["base_price"] = to_base(new_fields["price"], new_fields["currency"].lower())
+        stmt = update(Transaction).where(Transaction.id == transaction.id).values(**kwargs)
+        await self.db_handler.session.execute(stmt)
+        await self.db_handler.record_transactions([old_fields], sign=-1)
+        await self.db_handler.record_transactions([new_fields])
+
+    @log_to_db
+    async def checkout(self, user_id, currency, lines):
+        # A cart of purchases in one DB transaction, lines are {"product_id", "quantity"} dicts
+        currency = currency.lower()
+        if not lines:
+            raise ValueError("Checkout has no lines")
+        for line in lines:
+            await Validator.validate_transaction({"transaction_type": "purchase", "currency": currency, "quantity": line["quantity"]}, self.db_handler)
+        if await self.db_handler.get_by(User, id=user_id) is None:
+            raise ValueError(f"No user found with ID {user_id}")
+
+        # The same product can be on several lines, stock is checked against the total
+        needed = {}
+        for line in lines:
+            needed[line["product_id"]] = needed.get(line["product_id"], 0) + line["quantity"]
+
+        # The rows stay locked until commit, so the stock checked here is the stock the UPDATE changes
+        products = await self.db_handler.lock_products(needed)
+        for product_id, quantity in needed.items():
+            product = products.get(product_id)
+            if product is None:
+                raise ValueError(f"No product found with ID {product_id}")
+            if (product.quantity or 0) < quantity:
+                raise ValueError(f"Not enough stock for purchase of product {product_id}")
+        await self.db_handler.change_stock_many({product_id: -quantity for product_id, quantity in needed.items()})
+
+        now = datetime.now()
+        rows = []
+        for line in lines:
+            rows.append(validated_row(
+                Transaction,
+                product_id=line["product_id"],
+                user_id=user_id,
+                price=price_transaction(products[line["product_id"]], line["quantity"], "purchase", currency),
+                quantity=line["quantity"],
+                transaction_type="purchase",
+                currency=currency
+            ))
+            rows[-1].update(uuid=str(uuid.uuid4()), date=now, base_price=to_base(rows[-1]["price"], currency))
+        await self.db_handler.session.execute(insert(Transaction.__table__).values(rows))
+        await self.db_handler.record_transactions(rows)
+
+        # Multi-row inserts don't return ids on MySQL, read them back by uuid
+        result = await self.db_handler.session.execute(select(Transaction.uuid, Transaction.id).where(Transaction.uuid.in_([row["uuid"] for row in rows])))
+        ids = dict(result.all())
+        return [dict(row, id=ids[row["uuid"]]) for row in rows]
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def validated_row(model, **fields):
+    # The model constructor runs the same null, length and @validates checks as the single create path
+    instance = model(**fields)
+    return {key: getattr(instance, key) for key in fields}
+
+class BulkResults:
+    # Per-item outcome of a bulk request, keyed by the item's position in the request body
+    def __init__(self):
+        self.results = {}
+
+    def created(self, index, id):
+        self.results[index] = {"index": index, "status": "created", "id": id}
+
+    def failed(self, index, error):
+        self.results[index] = {"index": index, "status": "failed", "error": str(error)}
+
+    def count(self, status):
+        return sum(1 for result in self.results.values() if result["status"] == status)
+
+    def response(self):
+        return {
+            "created": self.count("created"),
+            "failed": self.count("failed"),
+            "results": [self.results[index] for index in sorted(self.results)],
+        }
+
+class BulkService:
+    # Set-based counterpart of Service for imports. Uniqueness and references are checked with one
+    # IN query per chunk, rows go in with multi-row inserts and each batch writes a single log entry.
+    # items are (index, dict) pairs that already passed the pydantic schema.
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+        self.session = db_handler.session
+        self.chunk_size = get_settings().bulk_chunk_size
+
+    async def run(self, func, items, results, create):
+        # results may already hold the items that failed the schema, they count towards the batch
+        total = len(items) + len(results.results)
+        try:
+            await create(items, results)
+        except Exception as e:
+            await self.log_batch(func, {"items": total}, "FAIL", str(e))
+            raise
+        summary = {"items": total, "created": results.count("created"), "failed": results.count("failed")}
+        await self.log_batch(func, summary, "OK")
+        return results
+
+    async def log_batch(self, func, summary, status, message=None):
+        kwargs_str = json.dumps(summary)
+        if status == "OK":
+            log_writer.enqueue_on_commit(self.db_handler, func, kwargs_str, status, message)
+        elif not await log_writer.enqueue(func, kwargs_str, status, message):
+            # The batch is rolled back, so the failure is written from a session of its own
+            async with self.db_handler.db_connect.sessionmaker() as log_session:
+                log_session.add(Log(func=func, kwargs=kwargs_str, status=status, message=message))
+                await log_session.commit()
+
+    async def existing(self, column, values, condition=None):
+        found = set()
+        for chunk in chunked(list(values), self.chunk_size):
+            stmt = select(column).where(column.in_(chunk))
+            if condition is not None:
+                stmt = stmt.where(condition)
+            result = await self.session.execute(stmt)
+            found.update(result.scalars())
+        return found
+
+    async def ids_by(self, column, values, condition=None):
+        # Multi-row inserts don't return ids on MySQL, they are read back by a unique column
+        ids = {}
+        for chunk in chunked(list(values), self.chunk_size):
+            stmt = select(column, column.class_.id).where(column.in_(chunk))
+            if condition is not None:
+                stmt = stmt.where(condition)
+            result = await self.session.execute(stmt)
+            ids.update(result.all())
+        return ids
+
+    async def insert_rows(self, model, rows):
+        for chunk in chunked(rows, self.chunk_size):
+            await self.session.execute(insert(model.__table__).values(chunk))
+
+    def drop_taken(self, rows, results, key, taken, message):
+        for index in [index for index, row in rows.items() if row[key] in taken]:
+            results.failed(index, message)
+            del rows[index]
+
+    async def create_users(self, items, results):
+        return await self.run("bulk_create_users", items, results, self.insert_users)
+
+    async def insert_users(self, items, results):
+        rows = {}
+        seen_usernames, seen_emails = set(), set()
+        for index, item in items:
+            try:
+                row = validated_row(User, username=item["username"], email=item["email"].lower(), password=item["password"])
+            except (ValueError, SQLAlchemyError) as e:
+                results.failed(index, e)
+                continue
+            if row["username"] in seen_usernames:
+                results.failed(index, "A user with this username already exists")
+            elif row["email"] in seen_emails:
+                results.failed(index, "A user with this email already exists")
+            else:
+                seen_usernames.add(row["username"])
+                seen_emails.add(row["email"])
+                rows[index] = row
+
+        self.drop_taken(rows, results, "username", await self.existing(User.username, seen_usernames), "A user with this username already exists")
+        self.drop_taken(rows, results, "email", await self.existing(User.email, seen_emails), "A user with this email already exists")
+
+        hashes = await asyncio.gather(*(passwords.hash(row["password"]) for row in rows.values()))
+        for row, password_hash in zip(rows.values(), hashes):
+            row.update(password=password_hash, uuid=str(uuid.uuid4()), type='user')
+        await self.insert_rows(User, list(rows.values()))
+
+        ids = await self.ids_by(User.uuid, [row["uuid"] for row in rows.values()])
+        for index, row in rows.items():
+            results.created(index, ids[row["uuid"]])
+
+    async def create_products(self, items, results):
+        return await self.run("bulk_create_products", items, results, self.insert_products)
+
+    async def insert_products(self, items, results):
+        rows = {}
+        category_names = {}
+        seen_names = set()
+        for index, item in items:
+            try:
+                row = validated_row(
+                    Product,
+                    name=item["name"],
+                    description=item["description"],
+                    purchase_price=item["purchase_price"],
+                    restock_price=item["restock_price"],
+                    currency=item["currency"],
+                    quantity=item["quantity"]
+                )
+            except (ValueError, SQLAlchemyError) as e:
+                results.failed(index, e)
+                continue
+            if row["name"] in seen_names:
+                results.failed(index, "A product with this name already exists")
+                continue
+            seen_names.add(row["name"])
+            rows[index] = row
+            category_names[index] = item["category_name"]
+
+        self.drop_taken(rows, results, "name", await self.existing(Product.name, seen_names), "A product with this name already exists")
+
+        # Unknown category names fall back to the default "Unknown" category, like create_product
+        names = {name for name in category_names.values() if name is not None} | {"Unknown"}
+        category_ids = await self.ids_by(Category.name, names, filter_deleted_references(Category))
+        now = datetime.now()
+        for index in list(rows):
+            category_id = category_ids.get(category_names[index]) or category_ids.get("Unknown")
+            if category_id is None:
+                results.failed(index, "No default \"Unknown\" category found")
+                del rows[index]
+                continue
+            rows[index].update(category_id=category_id, uuid=str(uuid.uuid4()), creation_date=now, changed_date=now)
+        await self.insert_rows(Product, list(rows.values()))
+
+        ids = await self.ids_by(Product.uuid, [row["uuid"] for row in rows.values()])
+        for index, row in rows.items():
+            results.created(index, ids[row["uuid"]])
+
+    async def create_categories(self, items, results):
+        return await self.run("bulk_create_categories", items, results, self.insert_categories)
+
+    async def insert_categories(self, items, results):
+        rows = {}
+        parents = {}
+        seen_names = set()
+        for index, item in items:
+            try:
+                row = validated_row(Category, name=item["name"], description=item["description"])
+            except (ValueError, SQLAlchemyError) as e:
+                results.failed(index, e)
+                continue
+            if row["name"] in seen_names:
+                results.failed(index, "A category with this name already exists")
+                continue
+            seen_names.add(row["name"])
+            rows[index] = row
+            parents[index] = (item["parent_name"], item["parent_id"])
+
+        self.drop_taken(rows, results, "name", await self.existing(Category.name, seen_names), "A category with this name already exists")
+
+        # The first categories ever created get the "Unknown" category next to them, like create_category
+        visible = await self.session.scalar(select(Category.id).where(filter_deleted_references(Category)).limit(1))
+        if visible is None and rows and not any(row["name"] == "Unknown" for row in rows.values()):
+            await self.insert_rows(Category, [{"name": "Unknown", "description": "Unknown category. Reference for products with no category assigned."}])
+
+        parent_ids = await self.existing(Category.id, {parent_id for name, parent_id in parents.values() if name is None and parent_id is not None}, filter_deleted_references(Category))
+        batch_names = {row["name"] for row in rows.values()}
+        parent_names = {name for name, parent_id in parents.values() if name is not None}
+        known = await self.ids_by(Category.name, parent_names, filter_deleted_references(Category))
+
+        # Missing parents are created bare, as create_category does for an unknown parent_name
+        missing = sorted(parent_names - batch_names - set(known))
+        if missing:
+            await self.insert_rows(Category, [{"name": name} for name in missing])
+            known.update(await self.ids_by(Category.name, missing))
+
+        # Insert level by level, a category goes in once its parent has an id
+        pending = {}
+        for index, row in rows.items():
+            parent_name, parent_id = parents[index]
+            if parent_name is None and parent_id is not None and parent_id not in parent_ids:
+                results.failed(index, f"No category found with ID {parent_id}")
+            else:
+                pending[index] = row
+        while pending:
+            ready = {}
+            for index, row in pending.items():
+                parent_name, parent_id = parents[index]
+                if parent_name is None:
+                    ready[index] = dict(row, parent_id=parent_id)
+                elif parent_name in known:
+                    ready[index] = dict(row, parent_id=known[parent_name])
+            if not ready:
+                for index in pending:
+                    results.failed(index, "Parent category is never created, the batch's parent names form a cycle")
+                break
+            await self.insert_rows(Category, list(ready.values()))
+            ids = await self.ids_by(Category.name, [row["name"] for row in ready.values()])
+            known.update(ids)
+            for index, row in ready.items():
+                results.created(index, ids[row["name"]])
+                del pending[index]
+
+        if rows or missing:
+            self.db_handler.on_commit(category_tree.invalidate)
+
+    async def create_transactions(self, items, results):
+        return await self.run("bulk_create_transactions", items, results, self.insert_transactions)
+
+    async def insert_transactions(self, items, results):
+        valid = []
+        for index, item in items:
+            # Same as create_transaction, "USD" is accepted and stored as "usd"
+            item = dict(item, currency=item["currency"].lower())
+            try:
+                await Validator.validate_transaction(item, self.db_handler)
+            except ValueError as e:
+                results.failed(index, e)
+                continue
+            valid.append((index, item))
+
+        # Chunks follow the sorted ids, so the locks are still taken in one global id order
+        products = {}
+        for chunk in chunked(sorted({item["product_id"] for index, item in valid}), self.chunk_size):
+            products.update(await self.db_handler.lock_products(chunk))
+        users = await self.existing(User.id, {item["user_id"] for index, item in valid})
+
+        # Stock is tracked in memory while the batch is applied in request order, the rows are locked
+        stock = {id: product.quantity or 0 for id, product in products.items()}
+        deltas = {}
+        rows = {}
+        now = datetime.now()
+        for index, item in valid:
+            product_id = item["product_id"]
+            product = products.get(product_id)
+            if product is None:
+                results.failed(index, f"No product found with ID {product_id}")
+                continue
+            if item["user_id"] not in users:
+                results.failed(index, f"No user found with ID {item['user_id']}")
+                continue
+            delta = STOCK_DIRECTIONS[item["transaction_type"]] * item["quantity"]
+            if stock[product_id] + delta < 0:
+                results.failed(index, "Not enough stock for purchase")
+                continue
+            try:
+                row = validated_row(
+                    Transaction,
+                    product_id=product_id,
+                    user_id=item["user_id"],
+                    price=price_transaction(product, item["quantity"], item["transaction_type"], item["currency"]),
+                    quantity=item["quantity"],
+                    transaction_type=item["transaction_type"],
+                    currency=item["currency"]
+                )
+            except (ValueError, SQLAlchemyError) as e:
+                results.failed(index, e)
+                continue
+            stock[product_id] += delta
+            deltas[product_id] = deltas.get(product_id, 0) + delta
+            rows[index] = dict(row, uuid=str(uuid.uuid4()), date=now, base_price=to_base(row["price"], row["currency"]))
+
+        # One stock UPDATE per chunk of touched products
+        changed = [product_id for product_id, delta in deltas.items() if delta != 0]
+        for chunk in chunked(changed, self.chunk_size):
+            await self.db_handler.change_stock_many({product_id: deltas[product_id] for product_id in chunk})
+        await self.insert_rows(Transaction, list(rows.values()))
+        await self.db_handler.record_transactions(rows.values())
+
+        ids = await self.ids_by(Transaction.uuid, [row["uuid"] for row in rows.values()])
+        for index, row in rows.items():
+            results.created(index, ids[row["uuid"]])
+
+async def apply_transaction_batch(batch):
+    # Group commit: one handler and one commit for a batch of create_transaction calls,
+    # each call runs in its own SAVEPOINT so a failing one doesn't take the others down
+    outcomes = []
+    async with AsyncDatabaseHandler("Transaction") as db_h:
+        for kwargs in batch:
+            kwargs_str = json.dumps(kwargs)
+            try:
+                # Unwrapped, log_to_db would write a FAIL row for a call whose SAVEPOINT is rolled back anyway
+                async with db_h.session.begin_nested():
+                    transaction = await Service.create_transaction.__wrapped__(db_h.service, **kwargs)
+                outcomes.append(transaction)
+                log_writer.enqueue_on_commit(db_h, "create_transaction", kwargs_str, "OK")
+            except Exception as e:
+                outcomes.append(e)
+                if not await log_writer.enqueue("create_transaction", kwargs_str, "FAIL", str(e)):
+                    db_h.session.add(Log(func="create_transaction", kwargs=kwargs_str, status="FAIL", message=str(e)))
+        try:
+            await db_h.commit()
+        except Exception as e:
+            # Nothing in the batch was written, every call failed with the commit
+            for kwargs in batch:
+                if not await log_writer.enqueue("create_transaction", json.dumps(kwargs), "FAIL", str(e)):
+                    async with db_h.db_connect.sessionmaker() as log_session:
+                        log_session.add(Log(func="create_transaction", kwargs=json.dumps(kwargs), status="FAIL", message=str(e)))
+                        await log_session.commit()
+            raise
+    return outcomes
+
 def filter_deleted_references(model):
+    # Sentinel ids are cached at startup, id <> :sentinel_id keeps primary key and secondary index access
+    sentinel_id = sentinels.get_id(model)
+    if sentinel_id is not None:
+        return model.id != sentinel_id
+    # Not cached yet, fall back to matching the sentinel names
     conditions = []
     if hasattr(model, 'name'):
         conditions.extend([model.name != 'deleted_user', model.name != 'deleted_category', model.name != 'deleted_product'])
     if hasattr(model, 'username'):
         conditions.append(model.username != 'deleted_user')
-    return and_(*conditions)
+    return and_(true(), *conditions)
+
+# Built once at import, handlers only do dict lookups per request
+# Lowercase class name -> model class, for every class in db_classes
+MODEL_REGISTRY = {name.lower(): cls for name, cls in inspect.getmembers(db_classes, inspect.isclass)}
+
+SERVICE_OPERATIONS = ['create', 'add', 'delete', 'delete_by_id', 'update', 'update_by_id']
+
+# (operation, lowercase class name) -> Service method, e.g. ('delete_by_id', 'product') -> Service.delete_by_id_product
+# Keyed by name, main.py and the modules in this folder import db_classes under different module names
+SERVICE_DISPATCH = {
+    (operation, name): getattr(Service, f"{operation}_{name}")
+    for operation in SERVICE_OPERATIONS
+    for name in MODEL_REGISTRY
+    if hasattr(Service, f"{operation}_{name}")
+}
 
 class AsyncDatabaseHandler():
-    def __init__(self, item_type=None):
+    def __init__(self, item_type=None, readonly=False):
         self.db_connect = None
         self.session = None
         self.item_type = item_type.lower() if item_type else None
-
-        # Get all classes from the db_classes module
-        all_classes = [cls for name, cls in inspect.getmembers(db_classes, inspect.isclass)]
-
-        # Create a type map from the class names to the classes
-        self.type_map = {cls.__name__.lower(): cls for cls in all_classes}
+        # Read-only handlers run on autocommit connections, no begin, flush or commit round trips
+        self.readonly = readonly
+        self.type_map = MODEL_REGISTRY
 
         # Create a Service object with session=None and db_handler=self
         self.service = Service(None, self)
 
+        # Callbacks for in-memory caches, run once this handler's work is committed
+        self.after_commit = []
+
     async def connect(self):
-        self.db_connect = await AsyncDatabaseConnect.connect_from_config()
+        self.db_connect = await AsyncDatabaseConnect.connect_from_config(readonly=self.readonly)
         self.session = await self.db_connect.get_new_session()
-        self.transaction = await self.session.begin()
         self.service.session = self.session
-        await self.session.flush()
+        if not self.readonly:
+            self.transaction = await self.session.begin()
+            await self.session.flush()
 
     async def __aenter__(self):
         await self.connect()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        print(f"exc_type: {exc_type}, exc_val: {exc_val}, exc_tb: {exc_tb}")
-        if self.transaction is not None and self.transaction.is_active:
-            if exc_type is not None:
-                await self.transaction.rollback()
-            else:
-                await self.transaction.commit()
-        await self.session.close()
-        await self.db_connect.close()
+        try:
+            # A mid-request commit() ends the first transaction, whatever came after it is still pending here
+            if not self.readonly and self.session.in_transaction():
+                if exc_type is not None:
+                    await self.session.rollback()
+                else:
+                    await self.session.commit()
+            if exc_type is None:
+                await self.run_after_commit()
+        finally:
+            # Always hand the connection back, a failed commit must not leak it from the pool
+            await self.session.close()
+            await self.db_connect.close()
+
+    def on_commit(self, callback):
+        if callback not in self.after_commit:
+            self.after_commit.append(callback)
+
+    async def record_transactions(self, transactions, sign=1):
+        # The rollups are written in this DB transaction, cached leaderboards over the days
+        # it touched are dropped once it commits
+        transactions = list(transactions)
+        await record_transactions(self.session, transactions, sign)
+        days = {transaction["date"].date() for transaction in transactions}
+        if days:
+            self.on_commit(lambda: top_reports.invalidate(days))
+
+    async def run_after_commit(self):
+        callbacks, self.after_commit = self.after_commit, []
+        for callback in callbacks:
+            # Callbacks may return a coroutine, e.g. queueing the log row of the committed work
+            result = callback()
+            if inspect.isawaitable(result):
+                await result
+
+    async def get_category_tree(self):
+        # Served from memory, the session is only used when the tree has to be (re)loaded
+        return await category_tree.ensure_loaded(self.session)
 
     async def start(self):
         self.transaction = await self.session.begin()
@@ -381,6 +887,7 @@ class AsyncDatabaseHandler():
         except Exception as e:
             await self.session.rollback()
             raise e
+        await self.run_after_commit()
         
     async def rollback(self):
         await self.session.rollback()
@@ -389,44 +896,47 @@ class AsyncDatabaseHandler():
         await self.session.close()
         await self.engine.dispose()
 
+    def service_method(self, operation, item_type_lower):
+        # Service methods are stored unbound, bind them to this handler's Service on the way out
+        method = SERVICE_DISPATCH.get((operation, item_type_lower))
+        return method.__get__(self.service) if method is not None else None
+
     async def create(self, **kwargs):
-        item_type_lower = self.item_type.lower()
-        if item_type_lower in self.type_map and hasattr(self.service, f"create_{item_type_lower}"):
-            create_method = getattr(self.service, f"create_{item_type_lower}")
+        create_method = self.service_method('create', self.item_type)
+        if create_method is not None:
             return await create_method(**kwargs)
         else:
             raise ValueError(f"Invalid item type: {self.item_type}")
 
+    async def checkout(self, **kwargs):
+        return await self.service.checkout(**kwargs)
+
     async def add(self, instance):
-        item_type_lower = type(instance).__name__.lower()
-        if hasattr(self.service, f"add_{item_type_lower}"):
-            add_method = getattr(self.service, f"add_{item_type_lower}")
+        add_method = self.service_method('add', type(instance).__name__.lower())
+        if add_method is not None:
             return await add_method(instance)
         else:
             self.session.add(instance)
 
     async def delete(self, instance):
-        item_type_lower = type(instance).__name__.lower()
-        if hasattr(self.service, f"delete_{item_type_lower}"):
-            delete_method = getattr(self.service, f"delete_{item_type_lower}")
+        delete_method = self.service_method('delete', type(instance).__name__.lower())
+        if delete_method is not None:
             return await delete_method(instance)
         else:
             await self.session.delete(instance)
 
-    async def delete_by_id(self, model, id):
+    async def delete_by_id(self, model, id, **kwargs):
         instance = await self.get_by_id(model, id)
         if instance is not None:
-            item_type_lower = type(instance).__name__.lower()
-            if hasattr(self.service, f"delete_by_id_{item_type_lower}"):
-                delete_method = getattr(self.service, f"delete_by_id_{item_type_lower}")
-                return await delete_method(instance)
+            delete_method = self.service_method('delete_by_id', type(instance).__name__.lower())
+            if delete_method is not None:
+                return await delete_method(instance, **kwargs)
             else:
                 await self.session.delete(instance)
 
     async def update(self, instance, **kwargs):
-        item_type_lower = type(instance).__name__.lower()
-        if hasattr(self.service, f"update_{item_type_lower}"):
-            update_method = getattr(self.service, f"update_{item_type_lower}")
+        update_method = self.service_method('update', type(instance).__name__.lower())
+        if update_method is not None:
             return await update_method(instance, **kwargs)
         else:
             stmt = update(instance.__class__).where(instance.__class__.id == instance.id).values(**kwargs)
@@ -435,15 +945,20 @@ class AsyncDatabaseHandler():
     async def update_by_id(self, model, id, **kwargs):
         instance = await self.get_by_id(model, id)
         if instance is not None:
-            item_type_lower = type(instance).__name__.lower()
-            if hasattr(self.service, f"update_by_id_{item_type_lower}"):
-                update_method = getattr(self.service, f"update_by_id_{item_type_lower}")
+            update_method = self.service_method('update_by_id', type(instance).__name__.lower())
+            if update_method is not None:
                 return await update_method(instance, **kwargs)
             else:
                 stmt = update(model).where(model.id == id).values(**kwargs)
                 await self.session.execute(stmt)
                 await self.session.commit()
 
+    def where_clause(self, model, condition=None, **filters):
+        conditions = [getattr(model, k) == v for k, v in filters.items()]
+        if condition is not None:
+            conditions.append(condition)
+        return and_(*conditions, filter_deleted_references(model))
+
     async def get_by_contains(self, model, **filters):
         stmt = select(model).where(and_(*[getattr(model, k).contains(v) for k, v in filters.items()], filter_deleted_references(model)))
         result = await self.session.execute(stmt)
@@ -454,7 +969,7 @@ class AsyncDatabaseHandler():
         return result.scalars().first()
 
     async def get_by(self, model, **filters):
-        stmt = select(model).where(and_(*[getattr(model, k) == v for k, v in filters.items()], filter_deleted_references(model)))
+        stmt = select(model).where(self.where_clause(model, **filters))
         result = await self.session.execute(stmt)
         return result.scalars().first()
 
@@ -463,9 +978,181 @@ class AsyncDatabaseHandler():
         return result.scalars().all()
 
     async def get_all_by(self, model, **filters):
-        result = await self.session.execute(select(model).where(and_(*[getattr(model, k) == v for k, v in filters.items()], filter_deleted_references(model))))
+        result = await self.session.execute(select(model).where(self.where_clause(model, **filters)))
         return result.scalars().all()
 
     async def get_all_with_condition(self, model, condition):
-        result = await self.session.execute(select(model).where(and_(condition, filter_deleted_references(model))))
-        return result.scalars().all()
\ No newline at end of file
+        result = await self.session.execute(select(model).where(self.where_clause(model, condition)))
+        return result.scalars().all()
+
+    async def stream_rows(self, model, condition=None, chunk_size=1000, **filters):
+        # Server-side cursor over plain column rows, memory stays flat however many rows match
+        stmt = (
+            select(*model.__table__.columns)
+            .where(self.where_clause(model, condition, **filters))
+            .order_by(model.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        result = await self.session.stream(stmt)
+        async for row in result.mappings():
+            yield row
+
+    async def get_page(self, model, limit=None, cursor=None, sort_key="id", descending=False, condition=None, stmt=None, **filters):
+        # Keyset pagination on (sort_key, id), returns the items and the cursor for the next page.
+        # stmt replaces the default select(model) for column selects, whose rows come back as mappings
+        if cursor is not None:
+            # The cursor carries its own ordering so follow-up pages can't drift
+            sort_key, descending, last_value, last_id = decode_cursor(cursor)
+        # Checked after decoding, a crafted cursor is held to the same list as the query parameter
+        if sort_key not in SORT_KEYS.get(model.__tablename__, ('id',)):
+            raise ValueError(f"Invalid sort key '{sort_key}'")
+        if model.__table__.c[sort_key].nullable:
+            raise ValueError(f"Sort key '{sort_key}' can be null and can't be used for paging")
+        # The next cursor is read from the page's last row, a column select has to return the sort key
+        if stmt is not None and sort_key not in stmt.selected_columns:
+            raise ValueError(f"Invalid sort key '{sort_key}'")
+        limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+        sort_column = getattr(model, sort_key)
+        as_mappings = stmt is not None
+        if stmt is None:
+            stmt = select(model)
+        stmt = stmt.where(self.where_clause(model, condition, **filters))
+        if cursor is not None:
+            if isinstance(sort_column.type, DateTime):
+                last_value = datetime.fromisoformat(last_value)
+            stmt = stmt.where(keyset_after(sort_column, model.id, last_value, last_id, descending))
+
+        if sort_key == "id":
+            order_by = [model.id.desc() if descending else model.id]
+        elif descending:
+            order_by = [sort_column.desc(), model.id.desc()]
+        else:
+            order_by = [sort_column, model.id]
+        # Fetch one extra row to know if there is a next page
+        stmt = stmt.order_by(*order_by).limit(limit + 1)
+        result = await self.session.execute(stmt)
+        items = result.mappings().all() if as_mappings else result.scalars().all()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            if as_mappings:
+                next_cursor = encode_cursor(sort_key, descending, last[sort_key], last["id"])
+            else:
+                next_cursor = encode_cursor(sort_key, descending, getattr(last, sort_key), last.id)
+        return items, next_cursor
+
+    async def get_product_pricing(self, product_id):
+        # Just the columns needed to price a transaction, no ORM object to keep in sync
+        stmt = select(Product.id, Product.purchase_price, Product.restock_price, Product.currency).where(self.where_clause(Product, id=product_id))
+        result = await self.session.execute(stmt)
+        return result.first()
+
+    async def change_stock(self, product_id, delta):
+        # UPDATE products SET quantity = quantity + :delta WHERE id = :id [AND quantity >= -:delta]
+        stmt = update(Product).where(Product.id == product_id).values(quantity=func.coalesce(Product.quantity, 0) + delta)
+        if delta < 0:
+            stmt = stmt.where(Product.quantity >= -delta)
+        result = await self.session.execute(stmt.execution_options(synchronize_session=False))
+        return result.rowcount == 1
+
+    async def lock_products(self, product_ids):
+        # SELECT ... FOR UPDATE in id order, concurrent writers touching the same products queue up instead of deadlocking
+        stmt = (
+            select(Product.id, Product.purchase_price, Product.restock_price, Product.currency, Product.quantity)
+            .where(self.where_clause(Product, Product.id.in_(sorted(product_ids))))
+            .order_by(Product.id)
+            .with_for_update()
+        )
+        result = await self.session.execute(stmt)
+        return {row.id: row for row in result}
+
+    async def change_stock_many(self, deltas):
+        # UPDATE products SET quantity = quantity + CASE id WHEN :id THEN :delta ... END WHERE id IN (...)
+        stock_change = case(deltas, value=Product.id, else_=0)
+        stmt = update(Product).where(Product.id.in_(list(deltas))).values(quantity=func.coalesce(Product.quantity, 0) + stock_change)
+        result = await self.session.execute(stmt.execution_options(synchronize_session=False))
+        return result.rowcount
+
+    async def get_category_subtree_ids(self, category_id, max_depth=None, min_depth=0):
+        tree = category_subtree_cte(category_id, max_depth)
+        result = await self.session.execute(select(tree.c.id).where(tree.c.depth >= min_depth))
+        return result.scalars().all()
+
+    async def get_products_in_category_subtree(self, category_id, max_depth=None, min_depth=0):
+        # The subtree walk and the product lookup go out as one statement, one round trip for any tree
+        tree = category_subtree_cte(category_id, max_depth)
+        category_ids = select(tree.c.id).where(tree.c.depth >= min_depth)
+        stmt = select(Product).where(self.where_clause(Product, Product.category_id.in_(category_ids))).order_by(Product.id)
+        result = await self.session.execute(stmt)
+        return result.scalars().all()
+
+    async def get_transaction_details(self, limit=None, cursor=None, sort_key="id", descending=False, condition=None, **filters):
+        # Transactions with their product, category and user names from one joined select.
+        # Without limit or cursor every matching row is returned and the next cursor is None
+        stmt = transaction_details_select()
+        if limit is None and cursor is None:
+            stmt = stmt.where(self.where_clause(Transaction, condition, **filters)).order_by(Transaction.id)
+            result = await self.session.execute(stmt)
+            return result.mappings().all(), None
+        return await self.get_page(Transaction, limit, cursor, sort_key, descending, condition, stmt=stmt, **filters)
+
+    async def get_report(self, report, currency, period=None, group_by=None, date_from=None, date_to=None, **filters):
+        # Aggregated by the database, closed days from the daily summary and the rest from the transactions
+        return await transaction_report(self.session, report, currency, period, parse_group_by(group_by), date_from, date_to, **filters)
+
+    async def get_user_activity(self, user_id, currency):
+        # Read from the activity rollups the transaction writes maintain, never from the transactions
+        return await activity(self.session, UserActivity, UserDailyActivity, 'user_id', user_id, currency)
+
+    async def get_product_activity(self, product_id, currency):
+        # Rolling windows come from the daily summary, which is kept per product already
+        return await activity(self.session, ProductActivity, TransactionDailySummary, 'product_id', product_id, currency)
+
+    async def get_top_report(self, metric, dimension, period, n, currency):
+        # Placeholder rows that deleted products, categories and users were merged into are left out
+        return await top_report(self.session, metric, dimension, period, n, currency, exclude=filter_deleted_references)
+
+def category_subtree_cte(category_id, max_depth=None):
+    # Recursive CTE of (id, depth) for a category and every category below it, depth 0 is the category itself
+    tree = (
+        select(Category.id, literal(0).label("depth"))
+        .where(Category.id == category_id)
+        .cte("category_tree", recursive=True)
+    )
+    children = select(Category.id, (tree.c.depth + 1).label("depth")).join(tree, Category.parent_id == tree.c.id)
+    if max_depth is not None:
+        children = children.where(tree.c.depth < max_depth)
+    return tree.union_all(children)
+
+def transaction_details_select():
+    # Only the columns TransactionResponse needs, categories are outer joined as products may have none
+    return (
+        select(
+            Transaction.id,
+            Transaction.product_id,
+            Product.name.label("product_name"),
+            Category.name.label("product_category"),
+            Transaction.user_id,
+            User.__table__.c.username.label("user_name"),
+            Transaction.date,
+            Transaction.price,
+            Transaction.currency,
+            Transaction.quantity,
+            Transaction.transaction_type,
+        )
+        .select_from(Transaction)
+        .join(Product, Transaction.product_id == Product.id)
+        .outerjoin(Category, Product.category_id == Category.id)
+        .join(User.__table__, Transaction.user_id == User.__table__.c.id)
+    )
+
+def keyset_after(sort_column, id_column, last_value, last_id, descending=False):
+    # Rows strictly after (last_value, last_id) in the page order, written out so MySQL can seek the index
+    if sort_column is id_column:
+        return id_column < last_id if descending else id_column > last_id
+    if descending:
+        return or_(sort_column < last_value, and_(sort_column == last_value, id_column < last_id))
+    return or_(sort_column > last_value, and_(sort_column == last_value, id_column > last_id))
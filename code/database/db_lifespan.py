@@ -0,0 +1,64 @@
+from db_connect import AsyncDatabaseConnect
+from db_settings import settings_loader, get_settings
+from db_category_tree import category_tree
+from db_sentinels import sentinels
+from db_log_writer import log_writer
+from db_services_async import log_retention
+from db_passwords import passwords
+from db_group_commit import group_commit
+from db_currency import currency_rates
+import asyncio
+import logging
+
+background_tasks = []
+
+async def startup():
+    # One pooled engine per worker process, shared by every AsyncDatabaseHandler
+    await AsyncDatabaseConnect.init_engine()
+    # Password hashing and checks run on a bounded worker pool off the event loop
+    passwords.start()
+    # Settings are reloaded in the background when a config file changes
+    background_tasks.append(asyncio.create_task(settings_loader.watch()))
+    await log_writer.start()
+    # Log retention prunes the logs table in small chunks alongside the API
+    background_tasks.append(asyncio.create_task(log_retention.run()))
+    # Sentinel rows exist before the first request so reads filter on a cached id
+    try:
+        async with AsyncDatabaseConnect.shared_sessionmaker() as session:
+            await sentinels.ensure(session)
+    except Exception as e:
+        logging.error(f"Failed to create sentinel rows: {e}")
+    # Currency rates are served from memory, until the first load the rates from currencies.json apply
+    try:
+        async with AsyncDatabaseConnect.shared_sessionmaker() as session:
+            await currency_rates.load(session)
+    except Exception as e:
+        logging.error(f"Failed to load currency rates: {e}")
+    background_tasks.append(asyncio.create_task(
+        currency_rates.watch(AsyncDatabaseConnect.shared_sessionmaker, get_settings().currency_rate_refresh_interval)
+    ))
+    # Category reads are served from memory, a failed load is retried lazily on the first read
+    try:
+        async with AsyncDatabaseConnect.shared_sessionmaker() as session:
+            await category_tree.load(session)
+    except Exception as e:
+        logging.error(f"Failed to load category tree: {e}")
+    background_tasks.append(asyncio.create_task(
+        category_tree.watch(AsyncDatabaseConnect.shared_sessionmaker, get_settings().category_tree_refresh_interval)
+    ))
+
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # A task that died earlier must not stop the logs from being flushed and the pool closed
+            logging.error(f"Background task failed: {e}")
+    background_tasks.clear()
+    # Flush queued logs while the pool is still open
+    await log_writer.stop()
+    await AsyncDatabaseConnect.dispose_engine()
+    passwords.shutdown()
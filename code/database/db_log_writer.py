@@ -0,0 +1,72 @@
+from db_classes import Log
+from db_connect import AsyncDatabaseConnect
+from db_settings import get_settings
+from db_batching import BatchCollector
+from sqlalchemy import insert
+from datetime import datetime
+import asyncio
+import logging
+import uuid
+
+OVERFLOW_POLICIES = ['drop_oldest', 'drop_newest', 'block']
+
+class AsyncLogWriter(BatchCollector):
+    def __init__(self):
+        super().__init__()
+        self.engine = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    async def start(self, engine=None):
+        settings = get_settings()
+        if settings.log_overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid log overflow policy '{settings.log_overflow_policy}', allowed policies are {OVERFLOW_POLICIES}")
+        self.engine = engine or AsyncDatabaseConnect.shared_engine
+        self.overflow_policy = settings.log_overflow_policy
+        # Written when log_batch_size rows are queued or log_flush_interval has passed since the first
+        self.start_collecting(settings.log_batch_size, settings.log_flush_interval, settings.log_queue_size)
+
+    async def enqueue(self, func, kwargs, status, message=None):
+        # Returns False when the writer isn't running so the caller can write the log itself
+        if not self.running:
+            return False
+        row = {
+            "uuid": str(uuid.uuid4()),
+            "date": datetime.now(),
+            "func": func,
+            "kwargs": kwargs,
+            "status": status,
+            "message": message,
+        }
+        if self.overflow_policy == 'block':
+            await self.queue.put(row)
+            return True
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow_policy == 'drop_oldest':
+                self.queue.get_nowait()
+                self.queue.put_nowait(row)
+        return True
+
+    def enqueue_on_commit(self, db_handler, func, kwargs, status, message=None):
+        # For logs of writes: queued only once db_handler's work is committed, so rolled back work
+        # leaves no row. Without the writer the row joins the same DB transaction instead
+        if self.running:
+            db_handler.on_commit(lambda: self.enqueue(func, kwargs, status, message))
+        else:
+            db_handler.session.add(Log(func=func, kwargs=kwargs, status=status, message=message))
+
+    async def flush(self, batch):
+        try:
+            async with self.engine.begin() as connection:
+                await connection.execute(insert(Log).values(batch))
+            self.written += len(batch)
+        except Exception as e:
+            # Losing log rows must never take the writer down
+            self.failed += len(batch)
+            logging.error(f"Failed to write {len(batch)} log rows: {e}")
+
+log_writer = AsyncLogWriter()
@@ -0,0 +1,38 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from db_settings import get_settings
+import asyncio
+
+PASSWORD_POOL_KINDS = ['thread', 'process']
+
+class PasswordHasher:
+    # Password hashing is deliberately slow, it runs on a bounded pool so it never blocks the event loop
+    def __init__(self):
+        self.executor = None
+
+    def start(self):
+        settings = get_settings()
+        if settings.password_pool_kind not in PASSWORD_POOL_KINDS:
+            raise ValueError(f"Invalid password pool kind '{settings.password_pool_kind}', allowed kinds are {PASSWORD_POOL_KINDS}")
+        if settings.password_pool_kind == 'process':
+            self.executor = ProcessPoolExecutor(max_workers=settings.password_pool_size)
+        else:
+            # hashlib releases the GIL while it hashes, so threads run in parallel without the process overhead
+            self.executor = ThreadPoolExecutor(max_workers=settings.password_pool_size, thread_name_prefix="password")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def run(self, func, *args):
+        # Without start() (scripts, tests) the loop's default thread pool is used
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def hash(self, password):
+        return await self.run(generate_password_hash, password)
+
+    async def verify(self, password_hash, password):
+        return await self.run(check_password_hash, password_hash, password)
+
+passwords = PasswordHasher()
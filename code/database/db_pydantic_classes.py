@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List, Dict
+from datetime import datetime
 
 class CategoryBase(BaseModel):
     name: str
@@ -61,15 +62,99 @@ class TransactionBase(BaseModel):
     quantity: int
     transaction_type: str
 
+class CurrencyRateBase(BaseModel):
+    currency: str
+    rate: float
+    effective_from: Optional[datetime] = None
+
+class CurrencyRateResponse(BaseModel):
+    id: int
+    currency: str
+    rate: float
+    effective_from: datetime
+
+class CheckoutLine(BaseModel):
+    product_id: int
+    quantity: int
+
+class CheckoutBase(BaseModel):
+    user_id: int
+    currency: str
+    lines: List[CheckoutLine]
+
+class CheckoutTransaction(BaseModel):
+    id: int
+    product_id: int
+    date: datetime
+    price: float
+    quantity: int
+
+class CheckoutResponse(BaseModel):
+    user_id: int
+    currency: str
+    total: float
+    transactions: List[CheckoutTransaction]
+
 class TransactionResponse(BaseModel):
     id: int
     product_id: int
     product_name: str
-    product_category: str
+    product_category: Optional[str] = None
     user_id: int
     user_name: str
-    date: str
+    date: datetime
     price: float
     currency: str
     quantity: int
-    transaction_type: str
\ No newline at end of file
+    transaction_type: str
+
+class ReportRow(BaseModel):
+    period: Optional[str] = None
+    transaction_type: Optional[str] = None
+    product_id: Optional[int] = None
+    product_name: Optional[str] = None
+    category_id: Optional[int] = None
+    category_name: Optional[str] = None
+    user_id: Optional[int] = None
+    user_name: Optional[str] = None
+    count: int
+    quantity: int
+    amount: float
+
+class ReportResponse(BaseModel):
+    report: str
+    currency: str
+    period: Optional[str] = None
+    group_by: List[str]
+    count: int
+    quantity: int
+    amount: float
+    rows: List[ReportRow]
+
+class TopRow(BaseModel):
+    id: int
+    name: str
+    count: int
+    quantity: int
+    amount: float
+
+class TopResponse(BaseModel):
+    metric: str
+    dimension: str
+    period: str
+    currency: str
+    rows: List[TopRow]
+
+class ActivityTotals(BaseModel):
+    count: int
+    quantity: int
+    amount: float
+
+class ActivityResponse(BaseModel):
+    id: int
+    currency: str
+    last_activity: Optional[datetime] = None
+    # Transaction type -> totals
+    lifetime: Dict[str, ActivityTotals]
+    last_7_days: Dict[str, ActivityTotals]
+    last_30_days: Dict[str, ActivityTotals]
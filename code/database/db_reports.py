@@ -0,0 +1,265 @@
+from db_classes import Transaction, TransactionDailySummary, ProductActivity, UserActivity, UserDailyActivity, Product, Category, User
+from db_settings import get_settings
+from db_currency import from_base, base_price_expression, currency_rates
+from sqlalchemy import select, func, and_, or_
+from datetime import datetime, time, timedelta
+
+# Report name -> transaction type it covers, None is every type.
+# Prices are stored signed, purchases are positive, refunds and restocks negative, so income is the plain sum
+REPORTS = {
+    'income': None,
+    'purchases': 'purchase',
+    'refunds': 'refund',
+    'restock': 'restock',
+}
+
+# Period -> MySQL DATE_FORMAT pattern of the bucket a transaction falls in
+REPORT_PERIODS = {
+    'day': '%Y-%m-%d',
+    'week': '%x-W%v',
+    'month': '%Y-%m',
+    'year': '%Y',
+}
+
+REPORT_DIMENSIONS = ['type', 'product', 'category', 'user']
+
+# The daily summary has no user, reports by user always read the transactions
+ROLLUP_DIMENSIONS = {'type', 'product', 'category'}
+
+def dimension_columns(source, dimension):
+    # Columns a dimension groups on, the id first and a readable name after it
+    if dimension == 'type':
+        return [source.transaction_type]
+    if dimension == 'product':
+        return [source.product_id, Product.name.label('product_name')]
+    if dimension == 'category':
+        return [Product.category_id, Category.name.label('category_name')]
+    return [source.user_id, User.username.label('user_name')]
+
+def parse_group_by(group_by):
+    # "product,type" -> ['product', 'type'], blanks and repeats are dropped
+    if not group_by:
+        return []
+    return list(dict.fromkeys(dimension.strip() for dimension in group_by.split(',') if dimension.strip()))
+
+def report_conditions(source, report, **filters):
+    if report not in REPORTS:
+        raise ValueError(f"Invalid report '{report}', allowed reports are {list(REPORTS)}")
+    conditions = [getattr(source, key) == value for key, value in filters.items()]
+    if REPORTS[report] is not None:
+        conditions.append(source.transaction_type == REPORTS[report])
+    return conditions
+
+def report_select(source, period=None, dimensions=(), conditions=()):
+    # One GROUP BY summing the amounts in the base currency. source is Transaction, or
+    # TransactionDailySummary whose rows are already summed per day
+    if period is not None and period not in REPORT_PERIODS:
+        raise ValueError(f"Invalid report period '{period}', allowed periods are {list(REPORT_PERIODS)}")
+    rollup = source is TransactionDailySummary
+    keys = []
+    if period is not None:
+        keys.append(func.date_format(source.day if rollup else source.date, REPORT_PERIODS[period]).label('period'))
+    for dimension in dimensions:
+        keys.extend(dimension_columns(source, dimension))
+
+    if rollup:
+        amount = source.base_price
+    else:
+        # Rows from before base_price existed are converted in the query until they're backfilled
+        amount = func.coalesce(source.base_price, base_price_expression(source.price, source.currency))
+    stmt = select(
+        *keys,
+        (func.sum(source.count) if rollup else func.count()).label('count'),
+        func.sum(source.quantity).label('quantity'),
+        func.sum(amount).label('amount'),
+    ).select_from(source)
+    if 'product' in dimensions or 'category' in dimensions:
+        stmt = stmt.outerjoin(Product, source.product_id == Product.id)
+    if 'category' in dimensions:
+        stmt = stmt.outerjoin(Category, Product.category_id == Category.id)
+    if 'user' in dimensions:
+        stmt = stmt.outerjoin(User, source.user_id == User.id)
+    if conditions:
+        stmt = stmt.where(and_(*conditions))
+    return stmt.group_by(*keys), [key.key for key in keys]
+
+def rollup_days(date_from, date_to, today):
+    # [start, end) of the whole, closed days the daily summary can answer for, None when there are none.
+    # Partial days at either end of the range and today come from the transactions
+    start = None
+    if date_from is not None:
+        start = date_from.date() if date_from.time() == time() else date_from.date() + timedelta(days=1)
+    end = today if date_to is None else min(today, date_to.date())
+    if start is not None and start >= end:
+        return None
+    return start, end
+
+def merge_groups(rows, keys, currency):
+    # The daily summary and the transactions can both return a group, their base amounts are added up
+    # and only the group totals are converted to the report currency
+    groups = {}
+    for row in rows:
+        key = tuple(row[name] for name in keys)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = dict(zip(keys, key), count=0, quantity=0, amount=0.0)
+        # Without group keys an empty SUM still comes back as one row of NULLs
+        group["count"] += row["count"] or 0
+        group["quantity"] += row["quantity"] or 0
+        group["amount"] += row["amount"] or 0.0
+    # Summary rows whose transactions were all deleted sum to nothing and are left out
+    keys = sorted((key for key in groups if groups[key]["count"]), key=lambda key: tuple((value is None, value) for value in key))
+    rates = currency_rates.rates_at()
+    for key in keys:
+        groups[key]["amount"] = from_base(groups[key]["amount"], currency, rates)
+    return [groups[key] for key in keys]
+
+async def transaction_report(session, report, currency, period=None, dimensions=(), date_from=None, date_to=None, **filters):
+    currency = currency.lower()
+    if currency not in get_settings().allowed_currencies:
+        raise ValueError("Invalid currency")
+    for dimension in dimensions:
+        if dimension not in REPORT_DIMENSIONS:
+            raise ValueError(f"Invalid report dimension '{dimension}', allowed dimensions are {REPORT_DIMENSIONS}")
+
+    raw_conditions = report_conditions(Transaction, report, **filters)
+    if date_from is not None:
+        raw_conditions.append(Transaction.date >= date_from)
+    if date_to is not None:
+        raw_conditions.append(Transaction.date <= date_to)
+
+    rows = []
+    days = None
+    if set(dimensions) <= ROLLUP_DIMENSIONS and set(filters) <= {'product_id'}:
+        days = rollup_days(date_from, date_to, datetime.now().date())
+    if days is not None:
+        start, end = days
+        rollup_conditions = report_conditions(TransactionDailySummary, report, **filters)
+        rollup_conditions.append(TransactionDailySummary.day < end)
+        outside = Transaction.date >= datetime.combine(end, time())
+        if start is not None:
+            rollup_conditions.append(TransactionDailySummary.day >= start)
+            outside = or_(Transaction.date < datetime.combine(start, time()), outside)
+        raw_conditions.append(outside)
+        stmt, keys = report_select(TransactionDailySummary, period, dimensions, rollup_conditions)
+        rows.extend((await session.execute(stmt)).mappings().all())
+
+    stmt, keys = report_select(Transaction, period, dimensions, raw_conditions)
+    rows.extend((await session.execute(stmt)).mappings().all())
+    return merge_groups(rows, keys, currency)
+
+# Leaderboard metric -> report column it ranks by, over purchases
+TOP_METRICS = {
+    'revenue': 'amount',
+    'quantity': 'quantity',
+    'count': 'count',
+}
+
+TOP_DIMENSIONS = ['product', 'category', 'user']
+
+TOP_PERIODS = ['day', 'week', 'month', 'year', 'all']
+
+def period_start(period, today):
+    # First day of the current period, None is all time
+    if period not in TOP_PERIODS:
+        raise ValueError(f"Invalid period '{period}', allowed periods are {TOP_PERIODS}")
+    if period == 'day':
+        return today
+    if period == 'week':
+        return today - timedelta(days=today.weekday())
+    if period == 'month':
+        return today.replace(day=1)
+    if period == 'year':
+        return today.replace(month=1, day=1)
+    return None
+
+def top_select(metric, dimension, since, limit, exclude=None):
+    # One GROUP BY ... ORDER BY ... LIMIT over the rollups. The writes keep today's rows up to date
+    # too, so the current period never reads the transactions. All time reads the lifetime rows
+    if dimension == 'user':
+        source = UserActivity if since is None else UserDailyActivity
+        model, name = User, User.username
+    else:
+        source = ProductActivity if since is None else TransactionDailySummary
+        model, name = (Product, Product.name) if dimension == 'product' else (Category, Category.name)
+    totals = {
+        'count': func.sum(source.count).label('count'),
+        'quantity': func.sum(source.quantity).label('quantity'),
+        'amount': func.sum(source.base_price).label('amount'),
+    }
+    conditions = [source.transaction_type == 'purchase']
+    if since is not None:
+        conditions.append(source.day >= since)
+    if exclude is not None:
+        conditions.append(exclude(model))
+    stmt = select(model.id.label('id'), name.label('name'), *totals.values()).select_from(source)
+    if dimension == 'user':
+        stmt = stmt.join(User, source.user_id == User.id)
+    else:
+        stmt = stmt.join(Product, source.product_id == Product.id)
+    if dimension == 'category':
+        stmt = stmt.join(Category, Product.category_id == Category.id)
+    return (
+        stmt.where(and_(*conditions))
+        .group_by(model.id, name)
+        # Rows whose transactions were all deleted sum to nothing and are left out
+        .having(totals['count'] > 0)
+        .order_by(totals[TOP_METRICS[metric]].desc(), model.id)
+        .limit(limit)
+    )
+
+class TopReportCache:
+    # Leaderboards in the base currency per (metric, dimension, period). An entry covers its period
+    # from the first day on and is dropped when a committed write touches one of those days.
+    # Writes from other worker processes only show once the entry expires
+    def __init__(self):
+        self.entries = {}
+        self.version = 0
+
+    def get(self, key, since):
+        entry = self.entries.get(key)
+        # A new day, week, month or year starts a new entry
+        if entry is None or entry["since"] != since or entry["expires"] <= datetime.now():
+            return None
+        return entry["rows"]
+
+    def put(self, key, since, rows, version):
+        # An invalidation that raced the query means the rows may already be stale
+        if version == self.version:
+            expires = datetime.now() + timedelta(seconds=get_settings().top_report_cache_ttl)
+            self.entries[key] = dict(since=since, rows=rows, expires=expires)
+
+    def invalidate(self, days=None):
+        # Without days everything goes, e.g. when a product moves category
+        self.version += 1
+        last = max(days) if days else None
+        for key, entry in list(self.entries.items()):
+            if last is None or entry["since"] is None or entry["since"] <= last:
+                del self.entries[key]
+
+top_reports = TopReportCache()
+
+async def top_report(session, metric, dimension, period, n, currency, exclude=None):
+    currency = currency.lower()
+    if currency not in get_settings().allowed_currencies:
+        raise ValueError("Invalid currency")
+    if metric not in TOP_METRICS:
+        raise ValueError(f"Invalid metric '{metric}', allowed metrics are {list(TOP_METRICS)}")
+    if dimension not in TOP_DIMENSIONS:
+        raise ValueError(f"Invalid dimension '{dimension}', allowed dimensions are {TOP_DIMENSIONS}")
+    size = get_settings().top_report_size
+    if not 1 <= n <= size:
+        raise ValueError(f"n must be between 1 and {size}")
+
+    since = period_start(period, datetime.now().date())
+    key = (metric, dimension, period)
+    rows = top_reports.get(key, since)
+    if rows is None:
+        # The largest allowed n is cached, smaller ones are a slice of it
+        version = top_reports.version
+        result = await session.execute(top_select(metric, dimension, since, size, exclude))
+        rows = [dict(row) for row in result.mappings()]
+        top_reports.put(key, since, rows, version)
+
+    rates = currency_rates.rates_at()
+    return [dict(row, amount=from_base(row["amount"], currency, rates)) for row in rows[:n]]
@@ -0,0 +1,244 @@
+from db_classes import Transaction, TransactionDailySummary, ProductActivity, UserActivity, UserDailyActivity
+from db_settings import get_settings
+from db_currency import to_base, from_base, base_price_expression, currency_rates
+from sqlalchemy import select, insert, update, delete, func, bindparam
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from datetime import datetime, timedelta
+
+# Transaction columns the rollups are built from
+SUMMARY_FIELDS = ('date', 'product_id', 'user_id', 'transaction_type', 'currency', 'quantity', 'price', 'base_price')
+
+# Rollup table -> key of the row a transaction is counted in, in primary key order
+ROLLUPS = {
+    TransactionDailySummary: lambda t: (t["date"].date(), t["product_id"], t["transaction_type"], t["currency"]),
+    ProductActivity: lambda t: (t["product_id"], t["transaction_type"]),
+    UserActivity: lambda t: (t["user_id"], t["transaction_type"]),
+    UserDailyActivity: lambda t: (t["user_id"], t["date"].date(), t["transaction_type"]),
+}
+
+# Rollup table -> SQL counterpart of its ROLLUPS key, used by rebuild_rollups
+ROLLUP_KEY_COLUMNS = {
+    TransactionDailySummary: (func.date(Transaction.date), Transaction.product_id, Transaction.transaction_type, Transaction.currency),
+    ProductActivity: (Transaction.product_id, Transaction.transaction_type),
+    UserActivity: (Transaction.user_id, Transaction.transaction_type),
+    UserDailyActivity: (Transaction.user_id, func.date(Transaction.date), Transaction.transaction_type),
+}
+
+# Lifetime rollup table -> the id it's rebuilt in ranges of, the others are rebuilt by day
+LIFETIME_ROLLUPS = {ProductActivity: 'product_id', UserActivity: 'user_id'}
+
+# Columns added up into a rollup row, each table has the ones it needs
+SUM_COLUMNS = ('count', 'quantity', 'price', 'base_price')
+
+# Activity window -> days it covers, today included
+ACTIVITY_WINDOWS = {'last_7_days': 7, 'last_30_days': 30}
+
+def transaction_fields(transaction):
+    return {field: getattr(transaction, field) for field in SUMMARY_FIELDS}
+
+def key_columns(model):
+    return [column.name for column in model.__table__.primary_key.columns]
+
+def rollup_upsert(model, rows):
+    # INSERT ... ON DUPLICATE KEY UPDATE adds to the existing row instead of replacing it
+    stmt = mysql_insert(model).values(rows)
+    columns = model.__table__.c
+    values = {name: columns[name] + stmt.inserted[name] for name in SUM_COLUMNS if name in columns}
+    if 'last_date' in columns:
+        # Only moves forward, taking a transaction back out leaves the last activity as it was
+        values['last_date'] = func.greatest(func.coalesce(columns.last_date, stmt.inserted.last_date), stmt.inserted.last_date)
+    return stmt.on_duplicate_key_update(**values)
+
+async def upsert_rollup_rows(session, model, rows):
+    # Sorted by key so concurrent writers lock the rollup rows in the same order
+    keys = key_columns(model)
+    rows = sorted(rows, key=lambda row: tuple(row[name] for name in keys))
+    chunk_size = get_settings().bulk_chunk_size
+    for start in range(0, len(rows), chunk_size):
+        await session.execute(rollup_upsert(model, rows[start:start + chunk_size]))
+
+async def record_transactions(session, transactions, sign=1):
+    # Every transaction write goes through here, in the same DB transaction, so the rollups
+    # commit or roll back with the rows they count. sign=-1 takes rows back out
+    transactions = list(transactions)
+    if not transactions:
+        return
+    for model, rollup_key in ROLLUPS.items():
+        columns = model.__table__.c
+        keys = key_columns(model)
+        totals = {}
+        for transaction in transactions:
+            key = rollup_key(transaction)
+            row = totals.get(key)
+            if row is None:
+                row = totals[key] = dict(zip(keys, key), **{name: 0 for name in SUM_COLUMNS if name in columns})
+                if 'last_date' in columns:
+                    row['last_date'] = transaction["date"]
+            row['count'] += sign
+            row['quantity'] += sign * transaction["quantity"]
+            if 'price' in columns:
+                row['price'] += sign * transaction["price"]
+            # Rows from before base_price existed are converted at the rates of their date,
+            # like backfill_base_price does for good
+            base_price = transaction["base_price"]
+            if base_price is None:
+                base_price = to_base(transaction["price"], transaction["currency"], currency_rates.rates_at(transaction["date"]))
+            row['base_price'] += sign * base_price
+            if 'last_date' in columns:
+                row['last_date'] = max(row['last_date'], transaction["date"])
+        await upsert_rollup_rows(session, model, totals.values())
+
+async def reassign_rollups(session, column_name, old_id, new_id):
+    # The rollup rows of a deleted product or user, a handful per day it was active,
+    # merged into the rows of its placeholder new_id
+    for model in ROLLUPS:
+        table = model.__table__
+        if column_name not in table.c:
+            continue
+        column = table.c[column_name]
+        result = await session.execute(select(table).where(column == old_id))
+        rows = [dict(row, **{column_name: new_id}) for row in result.mappings()]
+        await session.execute(delete(table).where(column == old_id))
+        if rows:
+            await upsert_rollup_rows(session, model, rows)
+
+async def activity(session, lifetime_model, daily_model, column_name, id, currency):
+    # Lifetime totals are one row per transaction type, the rolling windows sum at most
+    # a month of day rows, neither reads the transactions
+    currency = currency.lower()
+    if currency not in get_settings().allowed_currencies:
+        raise ValueError("Invalid currency")
+    lifetime_table = lifetime_model.__table__
+    daily_table = daily_model.__table__
+    rates = currency_rates.rates_at()
+    result = {'currency': currency, 'last_activity': None, 'lifetime': {}}
+
+    rows = (await session.execute(select(lifetime_table).where(lifetime_table.c[column_name] == id))).mappings().all()
+    for row in rows:
+        # Types whose transactions were all deleted are left out
+        if not row["count"]:
+            continue
+        result['lifetime'][row["transaction_type"]] = dict(count=row["count"], quantity=row["quantity"], amount=from_base(row["base_price"], currency, rates))
+        if row["last_date"] is not None and (result['last_activity'] is None or row["last_date"] > result['last_activity']):
+            result['last_activity'] = row["last_date"]
+
+    today = datetime.now().date()
+    since = {window: today - timedelta(days=days - 1) for window, days in ACTIVITY_WINDOWS.items()}
+    stmt = (
+        select(
+            daily_table.c.day,
+            daily_table.c.transaction_type,
+            func.sum(daily_table.c['count']).label('count'),
+            func.sum(daily_table.c.quantity).label('quantity'),
+            func.sum(daily_table.c.base_price).label('base_price'),
+        )
+        .where(daily_table.c[column_name] == id, daily_table.c.day >= min(since.values()))
+        .group_by(daily_table.c.day, daily_table.c.transaction_type)
+    )
+    days = (await session.execute(stmt)).mappings().all()
+    for window, start in since.items():
+        totals = {}
+        for row in days:
+            if row["day"] < start:
+                continue
+            total = totals.setdefault(row["transaction_type"], dict(count=0, quantity=0, amount=0.0))
+            total["count"] += row["count"]
+            total["quantity"] += row["quantity"]
+            total["amount"] += row["base_price"]
+        result[window] = {
+            transaction_type: dict(total, amount=from_base(total["amount"], currency, rates))
+            for transaction_type, total in sorted(totals.items()) if total["count"]
+        }
+    return result
+
+def rollup_select(model, where):
+    # The rollup rows of the transactions matching where, GROUP BY in the database
+    columns = model.__table__.c
+    aggregates = {
+        'count': func.count(),
+        'quantity': func.sum(Transaction.quantity),
+        'price': func.sum(Transaction.price),
+        # Rows backfill_base_price hasn't reached yet at the current rates, like the reports
+        'base_price': func.sum(func.coalesce(Transaction.base_price, base_price_expression(Transaction.price, Transaction.currency))),
+        'last_date': func.max(Transaction.date),
+    }
+    keys = ROLLUP_KEY_COLUMNS[model]
+    names = key_columns(model) + [name for name in aggregates if name in columns]
+    stmt = select(*keys, *[aggregates[name] for name in names[len(keys):]]).where(*where).group_by(*keys)
+    return insert(model.__table__).from_select(names, stmt)
+
+async def rebuild_rollup_range(session, models, where, delete_where):
+    # One DB transaction: lock the transactions in the range, then replace their rollup rows.
+    # Writers lock a transaction row before its rollup rows, taking them in the same order
+    # means a write to the range either commits before the rebuild reads it or waits for it
+    counted = await session.scalar(select(func.count()).select_from(Transaction).where(*where).with_for_update(read=True))
+    for model in models:
+        await session.execute(delete(model.__table__).where(*delete_where(model.__table__.c)))
+        await session.execute(rollup_select(model, where))
+    await session.commit()
+    return counted
+
+async def rebuild_rollups(sessionmaker, chunk_size=None):
+    # Recounts the rollups from the transactions with the API running. The day rollups are
+    # rebuilt rollup_rebuild_days at a time, the lifetime ones chunk_size product or user ids
+    # at a time, each range in one DB transaction so reports never see it half rebuilt
+    chunk_size = chunk_size or get_settings().bulk_chunk_size
+    days = timedelta(days=get_settings().rollup_rebuild_days)
+    day_rollups = [model for model in ROLLUPS if model not in LIFETIME_ROLLUPS]
+    async with sessionmaker() as session:
+        first, last = (await session.execute(select(func.min(Transaction.date), func.max(Transaction.date)))).one()
+
+    rebuilt = 0
+    day = first.date() if first is not None else None
+    while day is not None and day <= last.date():
+        # Transactions written after last are recorded by the writers, the last range stays open ended
+        start, end = datetime.combine(day, datetime.min.time()), datetime.combine(day + days, datetime.min.time())
+        where = [Transaction.date >= start] + ([Transaction.date < end] if end <= last else [])
+        delete_where = lambda columns: [columns.day >= day] + ([columns.day < day + days] if end <= last else [])
+        async with sessionmaker() as session:
+            rebuilt += await rebuild_rollup_range(session, day_rollups, where, delete_where)
+        day += days
+
+    for model, column_name in LIFETIME_ROLLUPS.items():
+        column = getattr(Transaction, column_name)
+        async with sessionmaker() as session:
+            max_id = await session.scalar(select(func.max(column)))
+        last_id = 0
+        while max_id is not None and last_id < max_id:
+            upper = last_id + chunk_size
+            where = [column > last_id] + ([column <= upper] if upper < max_id else [])
+            delete_where = lambda columns: [columns[column_name] > last_id] + ([columns[column_name] <= upper] if upper < max_id else [])
+            async with sessionmaker() as session:
+                await rebuild_rollup_range(session, [model], where, delete_where)
+            last_id = upper
+    return rebuilt
+
+async def backfill_base_price(sessionmaker, chunk_size=None):
+    # Fills base_price on rows written before it existed, converted at the rates of each row's
+    # date as the API would have then. Needs currency_rates loaded. One chunk of ids per DB
+    # transaction, its rows locked so a concurrent update can't change the price in between
+    chunk_size = chunk_size or get_settings().bulk_chunk_size
+    table = Transaction.__table__
+    stmt = update(table).where(table.c.id == bindparam('row_id')).values(base_price=bindparam('row_base_price'))
+    filled = 0
+    last_id = 0
+    while True:
+        async with sessionmaker() as session:
+            rows = (await session.execute(
+                select(Transaction.id, Transaction.price, Transaction.currency, Transaction.date)
+                # Rows in a currency without a rate are left NULL, the id keeps moving past them
+                .where(Transaction.id > last_id, Transaction.base_price.is_(None), Transaction.currency.in_(list(get_settings().conversion_rates)))
+                .order_by(Transaction.id)
+                .limit(chunk_size)
+                .with_for_update()
+            )).all()
+            if rows:
+                await session.execute(stmt, [
+                    dict(row_id=row.id, row_base_price=to_base(row.price, row.currency, currency_rates.rates_at(row.date)))
+                    for row in rows
+                ])
+            await session.commit()
+        filled += len(rows)
+        if len(rows) < chunk_size:
+            return filled
+        last_id = rows[-1].id
@@ -0,0 +1,37 @@
+from db_classes import Base
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+def add_missing_schema(connection):
+    # Brings an existing database up to the models without touching its data. Missing tables are
+    # created, and columns and indexes the models gained since are added to the existing tables.
+    # Nothing is dropped or altered, so running it again is a no-op. Sync, call through run_sync
+    inspector = inspect(connection)
+    existing = set(inspector.get_table_names())
+    missing = [table for table in Base.metadata.sorted_tables if table.name not in existing]
+    Base.metadata.create_all(connection, tables=missing)
+    changes = len(missing)
+
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                # Only nullable or defaulted columns can be added to a table that has rows
+                column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+                changes += 1
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+                changes += 1
+    return changes
+
+async def upgrade_schema(sessionmaker, chunk_size=None):
+    # Step for rebuild_rollups.py, returns the number of tables, columns and indexes added
+    async with sessionmaker() as session:
+        changes = await session.run_sync(lambda sync_session: add_missing_schema(sync_session.connection()))
+        await session.commit()
+    return changes
@@ -0,0 +1,65 @@
+from db_classes import Product, Category, User
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+# Placeholder rows that references are moved to when the row they point at is deleted
+# tablename: (model, lookup column, values the row is created with)
+SENTINEL_ROWS = {
+    'products': (Product, 'name', {'name': 'deleted_product', 'description': 'This is a placeholder for a deleted product', 'currency': 'USD'}),
+    'categories': (Category, 'name', {'name': 'deleted_category', 'description': 'This is a placeholder for a deleted category'}),
+    'users': (User, 'username', {'username': 'deleted_user', 'email': 'a@a.com', 'password': 'deleted_user'}),
+}
+
+class SentinelRegistry:
+    def __init__(self):
+        self.ids = {}
+
+    def get_id(self, model):
+        return self.ids.get(getattr(model, '__tablename__', None))
+
+    async def lookup(self, session, tablename):
+        model, column, values = SENTINEL_ROWS[tablename]
+        return await session.scalar(select(model.id).where(getattr(model, column) == values[column]))
+
+    async def create(self, session, tablename):
+        model, column, values = SENTINEL_ROWS[tablename]
+        instance = model(**values)
+        session.add(instance)
+        await session.flush()
+        return instance.id
+
+    async def ensure(self, session):
+        # Run once at startup, creates the missing sentinel rows and caches every id
+        ids = {}
+        for tablename in SENTINEL_ROWS:
+            id = await self.lookup(session, tablename)
+            if id is None:
+                try:
+                    async with session.begin_nested():
+                        id = await self.create(session, tablename)
+                except IntegrityError:
+                    # Another worker process created it first
+                    id = await self.lookup(session, tablename)
+            ids[tablename] = id
+        await session.commit()
+        self.ids.update(ids)
+
+    async def get_or_create(self, db_handler, model):
+        tablename = model.__tablename__
+        id = self.ids.get(tablename)
+        if id is not None:
+            return id
+        # Not cached when the app lifespan didn't run (scripts, tests), look it up like before
+        id = await self.lookup(db_handler.session, tablename)
+        if id is None:
+            id = await self.create(db_handler.session, tablename)
+            # Only cache a new row once it is committed, a rollback would leave a dangling id
+            db_handler.on_commit(lambda: self.ids.setdefault(tablename, id))
+        else:
+            self.ids[tablename] = id
+        return id
+
+    def clear(self):
+        self.ids.clear()
+
+sentinels = SentinelRegistry()
@@ -1,12 +1,10 @@
 from db_handler import *
 from db_connect import SingletonDatabaseConnect
+from db_settings import get_settings
 import time
 
-with open('../data/config.json', 'r') as f:
-    config = json.load(f)
-
-LOG_LIMIT = config['log_limit'] if 'log_limit' in config else 100
-LOG_LIMIT_INTERVAL = config['log_limit_interval'] if 'log_limit_interval' in config else 60
+LOG_LIMIT = get_settings().log_limit
+LOG_LIMIT_INTERVAL = get_settings().log_limit_interval
 
 class LogCleanupService:
     def __init__(self, limit=LOG_LIMIT, interval=LOG_LIMIT_INTERVAL):
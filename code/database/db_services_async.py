@@ -0,0 +1,109 @@
+from db_classes import Log
+from db_connect import AsyncDatabaseConnect
+from db_settings import get_settings
+from sqlalchemy import select, delete, func
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+class AsyncLogRetentionService:
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.interval = None
+        self.last_max_id = None
+        self.last_run = None
+        self.stats = {
+            "runs": 0,
+            "rows_pruned_total": 0,
+            "seconds_total": 0.0,
+            "last_rows_pruned": 0,
+            "last_seconds": 0.0,
+            "last_watermark": None,
+            "insert_rate": 0.0,
+            "interval": None,
+        }
+
+    async def run(self):
+        self.engine = self.engine or AsyncDatabaseConnect.shared_engine
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                # A failed cycle is retried on the next one, the API keeps running
+                logging.error(f"Log retention failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        settings = get_settings()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if self.interval is None:
+            self.interval = settings.log_limit_interval
+
+        async with self.engine.connect() as connection:
+            min_id = await connection.scalar(select(func.min(Log.id)))
+            max_id = await connection.scalar(select(func.max(Log.id)))
+            watermark = await self.find_watermark(connection, settings)
+
+        rows_pruned = 0
+        if watermark is not None and min_id is not None:
+            rows_pruned = await self.prune(min_id, watermark, settings.log_retention_chunk_size)
+
+        seconds = loop.time() - started
+        self.adapt_interval(max_id, started, settings)
+        self.stats["runs"] += 1
+        self.stats["rows_pruned_total"] += rows_pruned
+        self.stats["seconds_total"] += seconds
+        self.stats["last_rows_pruned"] = rows_pruned
+        self.stats["last_seconds"] = seconds
+        self.stats["last_watermark"] = watermark
+        self.stats["interval"] = self.interval
+        logging.info(f"Log retention pruned {rows_pruned} rows in {seconds:.3f}s, next run in {self.interval:.1f}s")
+        return rows_pruned
+
+    async def find_watermark(self, connection, settings):
+        # Highest log id that falls outside the retention window, every id at or below it is pruned
+        watermarks = []
+        if settings.log_limit:
+            # Newest row past the row-count limit, an index walk of log_limit rows
+            stmt = select(Log.id).order_by(Log.id.desc()).offset(settings.log_limit).limit(1)
+            watermarks.append(await connection.scalar(stmt))
+        if settings.log_max_age_days:
+            # Ids and dates grow together, so the first row young enough to keep bounds the old ones
+            cutoff = datetime.now() - timedelta(days=settings.log_max_age_days)
+            stmt = select(Log.id).where(Log.date >= cutoff).order_by(Log.date).limit(1)
+            first_kept_id = await connection.scalar(stmt)
+            if first_kept_id is None:
+                first_kept_id = await connection.scalar(select(func.max(Log.id) + 1))
+            if first_kept_id is not None:
+                watermarks.append(first_kept_id - 1)
+        watermarks = [watermark for watermark in watermarks if watermark is not None]
+        return max(watermarks) if watermarks else None
+
+    async def prune(self, min_id, watermark, chunk_size):
+        # Delete in bounded id ranges, each in its own short transaction so locks are released between chunks
+        rows_pruned = 0
+        low = min_id
+        while low <= watermark:
+            high = min(low + chunk_size - 1, watermark)
+            async with self.engine.begin() as connection:
+                result = await connection.execute(delete(Log).where(Log.id.between(low, high)))
+            rows_pruned += result.rowcount
+            low = high + 1
+            await asyncio.sleep(0)
+        return rows_pruned
+
+    def adapt_interval(self, max_id, started, settings):
+        # Aim for about one chunk of new logs per cycle
+        if max_id is not None and self.last_max_id is not None and started > self.last_run:
+            insert_rate = max(max_id - self.last_max_id, 0) / (started - self.last_run)
+            self.stats["insert_rate"] = insert_rate
+            if insert_rate > 0:
+                interval = settings.log_retention_chunk_size / insert_rate
+            else:
+                interval = settings.log_retention_max_interval
+            self.interval = min(max(interval, settings.log_retention_min_interval), settings.log_retention_max_interval)
+        self.last_max_id = max_id
+        self.last_run = started
+
+log_retention = AsyncLogRetentionService()
@@ -0,0 +1,194 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+import asyncio
+import json
+import logging
+import os
+import threading
+
+# Get the directory of the current script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(script_dir, '..', 'data')
+
+SETTINGS_FILES = {
+    'secrets': 'secrets.json',
+    'config': 'config_async.json',
+    'sync_config': 'config.json',
+    'currencies': 'currencies.json',
+}
+
+@dataclass(frozen=True)
+class Settings:
+    username: str
+    password: str
+    hostname: str
+    db_name: str
+    test_db_name: str
+    adapter: str
+    sync_adapter: str
+    test_mode: bool
+    log_limit: int
+    log_limit_interval: int
+    log_queue_size: int
+    log_batch_size: int
+    log_flush_interval: float
+    log_overflow_policy: str
+    log_max_age_days: int
+    log_retention_chunk_size: int
+    log_retention_min_interval: float
+    log_retention_max_interval: float
+    pool_size: int
+    max_overflow: int
+    readonly_pool_size: int
+    readonly_max_overflow: int
+    pool_recycle: int
+    pool_pre_ping: bool
+    settings_reload_interval: int
+    category_tree_refresh_interval: int
+    password_pool_kind: str
+    password_pool_size: int
+    bulk_chunk_size: int
+    rollup_rebuild_days: int
+    group_commit_enabled: bool
+    group_commit_window_ms: float
+    group_commit_max_batch: int
+    base_currency: str
+    currency_rate_refresh_interval: int
+    top_report_size: int
+    top_report_cache_ttl: float
+    allowed_currencies: tuple
+    conversion_rates: MappingProxyType
+
+    @property
+    def database_name(self):
+        if self.test_mode and self.test_db_name:
+            return self.test_db_name
+        return self.db_name
+
+    def db_url(self, adapter=None):
+        if self.username is None:
+            raise FileNotFoundError(f"No database secrets found, create {SETTINGS_FILES['secrets']} in {data_dir}")
+        adapter = adapter or self.adapter
+        return f"{adapter}://{self.username}:{self.password}@{self.hostname}/{self.database_name}"
+
+def is_true(value):
+    return str(value).lower() == "true"
+
+class SettingsLoader:
+    def __init__(self, directory=data_dir):
+        self.directory = directory
+        self.settings = None
+        self.mtimes = {}
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, SETTINGS_FILES[name])
+
+    def current_mtimes(self):
+        mtimes = {}
+        for name in SETTINGS_FILES:
+            try:
+                mtimes[name] = os.stat(self.path(name)).st_mtime_ns
+            except FileNotFoundError:
+                mtimes[name] = None
+        return mtimes
+
+    def read_json(self, name, required=True):
+        try:
+            with open(self.path(name), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # secrets.json is created by the user, everything else ships with the repo
+            if required:
+                raise
+            return {}
+
+    def load(self):
+        mtimes = self.current_mtimes()
+        secrets = self.read_json('secrets', required=False)
+        config = self.read_json('config')
+        sync_config = self.read_json('sync_config', required=False)
+        currencies = self.read_json('currencies')
+
+        settings = Settings(
+            username=secrets.get('username'),
+            password=secrets.get('password'),
+            hostname=secrets.get('hostname'),
+            db_name=secrets.get('db_name'),
+            test_db_name=secrets.get('test_db_name'),
+            adapter=config['adapter'],
+            sync_adapter=sync_config.get('adapter', 'mysql+pymysql'),
+            test_mode=is_true(config['test_mode']),
+            log_limit=config.get('log_limit', 100),
+            log_limit_interval=config.get('log_limit_interval', 60),
+            log_queue_size=config.get('log_queue_size', 10000),
+            log_batch_size=config.get('log_batch_size', 500),
+            log_flush_interval=config.get('log_flush_interval', 1.0),
+            log_overflow_policy=config.get('log_overflow_policy', 'drop_oldest'),
+            log_max_age_days=config.get('log_max_age_days', 0),
+            log_retention_chunk_size=config.get('log_retention_chunk_size', 1000),
+            log_retention_min_interval=config.get('log_retention_min_interval', 5),
+            log_retention_max_interval=config.get('log_retention_max_interval', 600),
+            pool_size=config.get('pool_size', 10),
+            max_overflow=config.get('max_overflow', 20),
+            readonly_pool_size=config.get('readonly_pool_size', 5),
+            readonly_max_overflow=config.get('readonly_max_overflow', 5),
+            pool_recycle=config.get('pool_recycle', 3600),
+            pool_pre_ping=is_true(config.get('pool_pre_ping', 'true')),
+            settings_reload_interval=config.get('settings_reload_interval', 5),
+            category_tree_refresh_interval=config.get('category_tree_refresh_interval', 60),
+            password_pool_kind=config.get('password_pool_kind', 'thread'),
+            password_pool_size=config.get('password_pool_size', 4),
+            bulk_chunk_size=config.get('bulk_chunk_size', 1000),
+            rollup_rebuild_days=config.get('rollup_rebuild_days', 7),
+            group_commit_enabled=is_true(config.get('group_commit_enabled', 'false')),
+            group_commit_window_ms=config.get('group_commit_window_ms', 5),
+            group_commit_max_batch=config.get('group_commit_max_batch', 200),
+            base_currency=config.get('base_currency', 'usd').lower(),
+            currency_rate_refresh_interval=config.get('currency_rate_refresh_interval', 60),
+            top_report_size=config.get('top_report_size', 100),
+            top_report_cache_ttl=config.get('top_report_cache_ttl', 60),
+            allowed_currencies=tuple(currencies['allowed_currencies']),
+            conversion_rates=MappingProxyType(dict(currencies['conversion_currencies'])),
+        )
+        self.settings = settings
+        self.mtimes = mtimes
+        return settings
+
+    def get(self):
+        # Hot path, no file I/O once loaded
+        settings = self.settings
+        if settings is None:
+            with self.lock:
+                if self.settings is None:
+                    self.load()
+                settings = self.settings
+        return settings
+
+    def refresh(self):
+        # Reload only when a file was touched since the last load
+        if self.current_mtimes() == self.mtimes:
+            return False
+        with self.lock:
+            if self.current_mtimes() == self.mtimes:
+                return False
+            try:
+                self.load()
+            except (ValueError, KeyError, OSError):
+                # Half written or briefly missing file (save by rename), keep the old settings and retry next round
+                return False
+        return True
+
+    async def watch(self, interval=None):
+        # Poll the mtimes off the event loop so requests never wait on the disk
+        while True:
+            await asyncio.sleep(interval or self.get().settings_reload_interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                logging.error(f"Failed to reload settings: {e}")
+
+settings_loader = SettingsLoader()
+
+def get_settings():
+    return settings_loader.get()
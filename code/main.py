@@ -1,19 +1,35 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import sys
 sys.path.append("database")
-from database.db_handler_async import AsyncDatabaseHandler
+from database.db_handler_async import AsyncDatabaseHandler, BulkService, BulkResults, apply_transaction_batch
+from database.db_lifespan import startup, shutdown, log_retention, passwords, group_commit
+from database.db_export import EXPORT_FORMATS, export_lines
+from database.db_reports import parse_group_by
 from database.db_classes import *
 from database.db_pydantic_classes import *
-from typing import List, Annotated
+from typing import List, Annotated, Optional
+from datetime import datetime
+from sqlalchemy import and_
+from contextlib import asynccontextmanager
+from pydantic import ValidationError
+import json
 import uvicorn
-from werkzeug.security import check_password_hash
 #uvicorn main:app --reload
 #npx create-react-app storage-app
 #http://localhost:8000/docs
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    # Opt-in group commit for /create_transaction/, off unless group_commit_enabled is set
+    await group_commit.start(apply_transaction_batch)
+    yield
+    await group_commit.stop()
+    await shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",  # React's default port
@@ -25,6 +41,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 @app.exception_handler(HTTPException)
@@ -34,6 +51,34 @@ async def http_exception_handler(request, exc):
         content={"detail": exc.detail},
     )
 
+# Request-scoped handlers, injected with Depends. The session only checks out a pooled connection
+# on its first query, so requests that fail validation or return early never touch the pool.
+# The handler commits, or rolls back on an exception, before the response is sent. Endpoints that
+# return a new row commit it themselves so the row has its id when the response is built.
+def handler_for(item_type=None, readonly=False):
+    async def handler():
+        async with AsyncDatabaseHandler(item_type, readonly=readonly) as db_h:
+            yield db_h
+    return handler
+
+ReadOnlyHandler = Annotated[AsyncDatabaseHandler, Depends(handler_for(readonly=True))]
+UserHandler = Annotated[AsyncDatabaseHandler, Depends(handler_for("User"))]
+AdminUserHandler = Annotated[AsyncDatabaseHandler, Depends(handler_for("AdminUser"))]
+CategoryHandler = Annotated[AsyncDatabaseHandler, Depends(handler_for("Category"))]
+ProductHandler = Annotated[AsyncDatabaseHandler, Depends(handler_for("Product"))]
+TransactionHandler = Annotated[AsyncDatabaseHandler, Depends(handler_for("Transaction"))]
+CurrencyRateHandler = Annotated[AsyncDatabaseHandler, Depends(handler_for("CurrencyRate"))]
+
+# Shared by the list endpoints. Without limit or cursor the whole list is returned as before,
+# otherwise one keyset page is returned and the next page's cursor is sent in X-Next-Cursor
+async def get_list(db_h, response, model, limit=None, cursor=None, sort_key="id", descending=False, **filters):
+    if limit is None and cursor is None:
+        return await db_h.get_all_by(model, **filters)
+    items, next_cursor = await db_h.get_page(model, limit=limit, cursor=cursor, sort_key=sort_key, descending=descending, **filters)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
 @app.post("/login_user/", response_model=LoginResponse)
 async def login_user(user: LoginBase):
     async with AsyncDatabaseHandler() as db_h:
@@ -47,7 +92,7 @@ async def login_user(user: LoginBase):
     if user_db is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if not check_password_hash(user_db.password, user.password):
+    if not await passwords.verify(user_db.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
     # Create a dictionary of user_db fields, excluding SQLAlchemy-specific fields
@@ -59,86 +104,82 @@ async def login_user(user: LoginBase):
 # User Creator
 # UserResponse model removes password from response
 @app.post("/create_user/", response_model=UserResponse) 
-async def create_user(user: UserBase):
-    async with AsyncDatabaseHandler("User") as db_h:
-        try:
-            user = await db_h.create(
-                username=user.username,
-                password=user.password,
-                email=user.email
-            )
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to create user: {e}")
+async def create_user(user: UserBase, db_h: UserHandler):
+    try:
+        user = await db_h.create(
+            username=user.username,
+            password=user.password,
+            email=user.email
+        )
+        await db_h.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to create user: {e}")
     user_response = UserResponse(**user.__dict__)
     return user_response
 
 # AdminUserResponse model removes password from response
 @app.post("/create_admin_user/", response_model=AdminUserResponse) 
-async def create_admin_user(admin_user: AdminUserBase):
-    async with AsyncDatabaseHandler("AdminUser") as db_h:
-        try:
-            admin_user = await db_h.create(
-                username=admin_user.username,
-                password=admin_user.password,
-                email=admin_user.email,
-                admin_status=admin_user.admin_status
-            )
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to create admin user: {e}")
+async def create_admin_user(admin_user: AdminUserBase, db_h: AdminUserHandler):
+    try:
+        admin_user = await db_h.create(
+            username=admin_user.username,
+            password=admin_user.password,
+            email=admin_user.email,
+            admin_status=admin_user.admin_status
+        )
+        await db_h.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to create admin user: {e}")
     admin_user_response = AdminUserResponse(**admin_user.__dict__)
     return admin_user_response
 
 # User Delete
 @app.delete("/delete_user/{user_id}/")
-async def delete_user(user_id: int):
-    async with AsyncDatabaseHandler("User") as db_h:
-        try:
-            await db_h.delete_by_id(User, id=user_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to delete user: {e}")
+async def delete_user(user_id: int, db_h: UserHandler, chunk_size: Optional[int] = None):
+    try:
+        await db_h.delete_by_id(User, id=user_id, chunk_size=chunk_size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to delete user: {e}")
     return {"detail": "User deleted"}
 
 # AdminUser Delete
 @app.delete("/delete_admin_user/{user_id}/")
-async def delete_admin_user(user_id: int):
-    async with AsyncDatabaseHandler("AdminUser") as db_h:
-        try:
-            await db_h.delete_by_id(AdminUser, id=user_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to delete admin user: {e}")
+async def delete_admin_user(user_id: int, db_h: AdminUserHandler):
+    try:
+        await db_h.delete_by_id(AdminUser, id=user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to delete admin user: {e}")
     return {"detail": "Admin user deleted"}
 
 # User Update
 @app.put("/update_user/{user_id}/")
-async def update_user(user_id: int, user: UserBase):
-    async with AsyncDatabaseHandler("User") as db_h:
-        try:
-            await db_h.update_by_id(User, id=user_id, **user.dict())
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to update user: {e}")
+async def update_user(user_id: int, user: UserBase, db_h: UserHandler):
+    try:
+        await db_h.update_by_id(User, id=user_id, **user.dict())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to update user: {e}")
     return {"detail": "User updated"}
 
 # User Getters
 @app.get("/get_user/{user_id}/", response_model=UserResponse)
-async def get_user(user_id: int):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            user = await db_h.get_by(User, id=user_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get user: {e}")
-        
+async def get_user(user_id: int, db_h: ReadOnlyHandler):
+    try:
+        user = await db_h.get_by(User, id=user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get user: {e}")
+    
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -146,15 +187,14 @@ async def get_user(user_id: int):
     return user_response
 
 @app.get("/get_user_by_username/{username}/", response_model=UserResponse)
-async def get_user_by_username(username: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            user = await db_h.get_by(User, username=username)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get user: {e}")
-        
+async def get_user_by_username(username: str, db_h: ReadOnlyHandler):
+    try:
+        user = await db_h.get_by(User, username=username)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get user: {e}")
+    
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -162,15 +202,14 @@ async def get_user_by_username(username: str):
     return user_response
 
 @app.get("/get_users/", response_model=List[UserResponse])
-async def get_users():
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            users = await db_h.get_all(User)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get users: {e}")
-    
+async def get_users(response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        users = await get_list(db_h, response, User, limit, cursor, sort_key, descending)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get users: {e}")
+
     if users is None:
         raise HTTPException(status_code=404, detail="No users found")
 
@@ -178,15 +217,14 @@ async def get_users():
     return user_responses
 
 @app.get("/get_admin_users/", response_model=List[AdminUserResponse])
-async def get_admin_users():
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            admin_users = await db_h.get_all(AdminUser)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get admin users: {e}")
-        
+async def get_admin_users(db_h: ReadOnlyHandler):
+    try:
+        admin_users = await db_h.get_all(AdminUser)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get admin users: {e}")
+    
     if admin_users is None:
         raise HTTPException(status_code=404, detail="No users found")
     
@@ -195,104 +233,121 @@ async def get_admin_users():
 
 # Category Creator
 @app.post("/create_category/")
-async def create_category(category: CategoryBase):
-    async with AsyncDatabaseHandler("Category") as db_h:
-        try:
-            category = await db_h.create(
-                name=category.name,
-                description=category.description,
-                parent_id=category.parent_id,
-                parent_name=category.parent_name
-            )
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to create category: {e}")
+async def create_category(category: CategoryBase, db_h: CategoryHandler):
+    try:
+        category = await db_h.create(
+            name=category.name,
+            description=category.description,
+            parent_id=category.parent_id,
+            parent_name=category.parent_name
+        )
+        await db_h.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to create category: {e}")
     return category
 
 # Category Delete
 @app.delete("/delete_category/{category_id}/")
-async def delete_category(category_id: int):
-    async with AsyncDatabaseHandler("Category") as db_h:
-        try:
-            await db_h.delete_by_id(Category, id=category_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to delete category: {e}")
+async def delete_category(category_id: int, db_h: CategoryHandler, chunk_size: Optional[int] = None):
+    try:
+        await db_h.delete_by_id(Category, id=category_id, chunk_size=chunk_size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to delete category: {e}")
     return {"detail": "Category deleted"}
 
 # Category Update
 @app.put("/update_category/{category_id}/")
-async def update_category(category_id: int, category: CategoryBase):
-    async with AsyncDatabaseHandler("Category") as db_h:
-        try:
-            await db_h.update_by_id(Category, id=category_id, **category.dict())
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to update category: {e}")
+async def update_category(category_id: int, category: CategoryBase, db_h: CategoryHandler):
+    try:
+        await db_h.update_by_id(Category, id=category_id, **category.dict())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to update category: {e}")
     return {"detail": "Category updated"}
 
 # Category Getters
 @app.get("/get_category/{category_id}/")
-async def get_category(category_id: int):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            category = await db_h.get_by(Category, id=category_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get category: {e}")
-        
+async def get_category(category_id: int, db_h: ReadOnlyHandler):
+    try:
+        category_tree = await db_h.get_category_tree()
+        category = category_tree.get(category_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get category: {e}")
+    
     if category is None:
         raise HTTPException(status_code=404, detail="Category not found")
 
     return category
 
 @app.get("/get_category_by_name/{category_name}/")
-async def get_category_by_name(category_name: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            category = await db_h.get_by(Category, name=category_name)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get category: {e}")
-        
+async def get_category_by_name(category_name: str, db_h: ReadOnlyHandler):
+    try:
+        category_tree = await db_h.get_category_tree()
+        category = category_tree.get_by_name(category_name)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get category: {e}")
+    
     if category is None:
         raise HTTPException(status_code=404, detail="Category not found")
     
     return category
 
+# Breadcrumb from the top-level category down to the given one
+@app.get("/get_category_path/{category_name}/")
+async def get_category_path(category_name: str, db_h: ReadOnlyHandler):
+    try:
+        category_tree = await db_h.get_category_tree()
+        category = category_tree.get_by_name(category_name)
+        if category is None:
+            raise HTTPException(status_code=404, detail="Category not found")
+        path = category_tree.path(category["id"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get category path: {e}")
+
+    return path
+
 @app.get("/get_subcategories/{category_name}/")
-async def get_subcategories(category_name: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            category = await db_h.get_by(Category, name=category_name)
-            if category is None:
-                raise HTTPException(status_code=404, detail="Category not found")
-            subcategories = await db_h.get_all_by(Category, parent_id=category.id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get subcategories: {e}")
-        
+async def get_subcategories(category_name: str, db_h: ReadOnlyHandler):
+    try:
+        category_tree = await db_h.get_category_tree()
+        category = category_tree.get_by_name(category_name)
+        if category is None:
+            raise HTTPException(status_code=404, detail="Category not found")
+        subcategories = category_tree.subcategories(category["id"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get subcategories: {e}")
+    
     if subcategories is None:
         raise HTTPException(status_code=404, detail="No subcategories found")            
 
     return subcategories
 
 @app.get("/get_categories/")
-async def get_categories():
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            categories = await db_h.get_all(Category)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get categories: {e}")
-        
+async def get_categories(response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        if limit is None and cursor is None:
+            category_tree = await db_h.get_category_tree()
+            categories = category_tree.all()
+        else:
+            categories = await get_list(db_h, response, Category, limit, cursor, sort_key, descending)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get categories: {e}")
+    
     if categories is None:
         raise HTTPException(status_code=404, detail="No categories found")
 
@@ -300,147 +355,132 @@ async def get_categories():
 
 # Product Creator
 @app.post("/create_product/")
-async def create_product(product: ProductBase):
-    async with AsyncDatabaseHandler("Product") as db_h:
-        try:
-            product = await db_h.create(
-                name=product.name,
-                description=product.description,
-                category_name=product.category_name,
-                purchase_price=product.purchase_price,
-                restock_price=product.restock_price,
-                currency=product.currency,
-                quantity=product.quantity
-            )
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to create product: {e}")
+async def create_product(product: ProductBase, db_h: ProductHandler):
+    try:
+        product = await db_h.create(
+            name=product.name,
+            description=product.description,
+            category_name=product.category_name,
+            purchase_price=product.purchase_price,
+            restock_price=product.restock_price,
+            currency=product.currency,
+            quantity=product.quantity
+        )
+        await db_h.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to create product: {e}")
     return product
 
 # Product Delete
 @app.delete("/delete_product/{product_id}/")
-async def delete_product(product_id: int):
-    async with AsyncDatabaseHandler("Product") as db_h:
-        try:
-            await db_h.delete_by_id(Product, product_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to delete product: {e}")
+async def delete_product(product_id: int, db_h: ProductHandler, chunk_size: Optional[int] = None):
+    try:
+        await db_h.delete_by_id(Product, product_id, chunk_size=chunk_size)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to delete product: {e}")
     return {"detail": "Product deleted"}
 
 # Product Update
 @app.put("/update_product/{product_id}/")
-async def update_product(product_id: int, product: ProductBase):
-    async with AsyncDatabaseHandler("Product") as db_h:
-        try:
-            await db_h.update_by_id(Product, id=product_id, **product.dict())
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to update product: {e}")
+async def update_product(product_id: int, product: ProductBase, db_h: ProductHandler):
+    try:
+        await db_h.update_by_id(Product, id=product_id, **product.dict())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to update product: {e}")
     return {"detail": "Product updated"}
 
 # Product Getters
 @app.get("/get_product/{product_id}/")
-async def get_product(product_id: int):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            product = await db_h.get_by(Product, id=product_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get product: {e}")
-        
+async def get_product(product_id: int, db_h: ReadOnlyHandler):
+    try:
+        product = await db_h.get_by(Product, id=product_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get product: {e}")
+    
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
     return product
 
 @app.get("/get_product_by_name/{product_name}/")
-async def get_product_by_name(product_name: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            product = await db_h.get_by(Product, name=product_name)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get product: {e}")
-        
+async def get_product_by_name(product_name: str, db_h: ReadOnlyHandler):
+    try:
+        product = await db_h.get_by(Product, name=product_name)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get product: {e}")
+    
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
     return product
 
 @app.get("/get_products_by_category/{category_name}/")
-async def get_products_by_category(category_name: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            category = await db_h.get_by(Category, name=category_name)
-            if category is None:
-                raise HTTPException(status_code=404, detail="Category not found")
-            products = await db_h.get_all_by(Product, category_id=category.id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
-        
+async def get_products_by_category(category_name: str, db_h: ReadOnlyHandler):
+    try:
+        category = await db_h.get_by(Category, name=category_name)
+        if category is None:
+            raise HTTPException(status_code=404, detail="Category not found")
+        products = await db_h.get_all_by(Product, category_id=category.id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
+    
     if products is None:
         raise HTTPException(status_code=404, detail="No products found")
 
     return products
 
-async def get_products_in_category_and_subcategories(db_h, category_id):
-    products = await db_h.get_all_by(Product, category_id=category_id)
-    subcategories = await db_h.get_all_by(Category, parent_id=category_id)
-    for subcategory in subcategories:
-        products += await get_products_in_category_and_subcategories(db_h, subcategory.id)
-    return products
-
 @app.get("/get_products_by_category_with_subcategories/{category_name}/")
-async def get_products_by_category_with_subcategories(category_name: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            category = await db_h.get_by(Category, name=category_name)
-            if category is None:
-                raise HTTPException(status_code=404, detail="Category not found")
-            products = await get_products_in_category_and_subcategories(db_h, category.id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
-        
+async def get_products_by_category_with_subcategories(category_name: str, db_h: ReadOnlyHandler, max_depth: Optional[int] = None, min_depth: int = 0):
+    try:
+        category = await db_h.get_by(Category, name=category_name)
+        if category is None:
+            raise HTTPException(status_code=404, detail="Category not found")
+        products = await db_h.get_products_in_category_subtree(category.id, max_depth=max_depth, min_depth=min_depth)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
+    
     if products is None:
         raise HTTPException(status_code=404, detail="No products found")
 
     return products
 
 @app.get("/get_products_with_quantity_less_than/{quantity}/")
-async def get_products_with_quantity_less_than(quantity: int):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            products = await db_h.get_all_with_condition(Product, Product.quantity < quantity)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
-        
+async def get_products_with_quantity_less_than(quantity: int, db_h: ReadOnlyHandler):
+    try:
+        products = await db_h.get_all_with_condition(Product, Product.quantity < quantity)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
+    
     if products is None:
         raise HTTPException(status_code=404, detail="No products found")
     
     return products
 
 @app.get("/get_products/")
-async def get_products():
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            products = await db_h.get_all(Product)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
-        
+async def get_products(response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        products = await get_list(db_h, response, Product, limit, cursor, sort_key, descending)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get products: {e}")
+    
     if products is None:
         raise HTTPException(status_code=404, detail="No products found")
 
@@ -448,152 +488,177 @@ async def get_products():
 
 # Transaction Creator
 @app.post("/create_transaction/")
-async def create_transaction(transaction: TransactionBase):
-    async with AsyncDatabaseHandler("Transaction") as db_h:
-        try:
-            transaction = await db_h.create(
-                product_id=transaction.product_id,
-                user_id=transaction.user_id,
-                currency=transaction.currency,
-                quantity=transaction.quantity,
-                transaction_type=transaction.transaction_type
-            )
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to create transaction: {e}")
+async def create_transaction(transaction: TransactionBase, db_h: TransactionHandler):
+    kwargs = dict(
+        product_id=transaction.product_id,
+        user_id=transaction.user_id,
+        currency=transaction.currency,
+        quantity=transaction.quantity,
+        transaction_type=transaction.transaction_type
+    )
+    try:
+        if group_commit.running:
+            # Applied and committed together with the other calls from the same few milliseconds
+            transaction = await group_commit.submit(**kwargs)
+        else:
+            transaction = await db_h.create(**kwargs)
+            await db_h.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to create transaction: {e}")
     return transaction
 
+# Checkout, every line of the cart is bought in one database transaction or none are
+@app.post("/checkout/", response_model=CheckoutResponse)
+async def checkout(cart: CheckoutBase, db_h: TransactionHandler):
+    try:
+        transactions = await db_h.checkout(
+            user_id=cart.user_id,
+            currency=cart.currency,
+            lines=[line.dict() for line in cart.lines]
+        )
+        await db_h.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to checkout: {e}")
+    return CheckoutResponse(
+        user_id=cart.user_id,
+        currency=cart.currency.lower(),
+        total=sum(transaction["price"] for transaction in transactions),
+        transactions=transactions
+    )
+
 # Transaction Delete
 @app.delete("/delete_transaction/{transaction_id}/")
-async def delete_transaction(transaction_id: int):
-    async with AsyncDatabaseHandler("Transaction") as db_h:
-        try:
-            await db_h.delete_by_id(Transaction, id=transaction_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to delete transaction: {e}")
+async def delete_transaction(transaction_id: int, db_h: TransactionHandler):
+    try:
+        await db_h.delete_by_id(Transaction, id=transaction_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to delete transaction: {e}")
     return {"detail": "Transaction deleted"}
 
 # Transaction Update
 @app.put("/update_transaction/{transaction_id}/")
-async def update_transaction(transaction_id: int, transaction: TransactionBase):
-    async with AsyncDatabaseHandler("Transaction") as db_h:
-        try:
-            await db_h.update_by_id(Transaction, id=transaction_id, **transaction.dict())
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to update transaction: {e}")
+async def update_transaction(transaction_id: int, transaction: TransactionBase, db_h: TransactionHandler):
+    try:
+        await db_h.update_by_id(Transaction, id=transaction_id, **transaction.dict())
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to update transaction: {e}")
     return {"detail": "Transaction updated"}
 
 # Transaction Getters
-@app.get("/get_transaction/{transaction_id}/")
-async def get_transaction(transaction_id: int):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            transaction = await db_h.get_by(Transaction, id=transaction_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get transaction: {e}")
-        
-    if transaction is None:
+# Transactions are returned as TransactionResponse rows with product, category and user names
+# from one joined select, so clients don't need a lookup per row
+async def get_transaction_list(db_h, response, limit=None, cursor=None, sort_key="id", descending=False, **filters):
+    transactions, next_cursor = await db_h.get_transaction_details(limit, cursor, sort_key, descending, **filters)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [TransactionResponse(**transaction) for transaction in transactions]
+
+@app.get("/get_transaction/{transaction_id}/", response_model=TransactionResponse)
+async def get_transaction(transaction_id: int, db_h: ReadOnlyHandler):
+    try:
+        transactions, _ = await db_h.get_transaction_details(id=transaction_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get transaction: {e}")
+    
+    if not transactions:
         raise HTTPException(status_code=404, detail="Transaction not found")
 
-    return transaction
+    return TransactionResponse(**transactions[0])
 
-@app.get("/get_transactions_by_user_id/{user_id}/")
-async def get_transactions_by_user(user_id: int):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            transactions = await db_h.get_all_by(Transaction, user_id=user_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
-        
+@app.get("/get_transactions_by_user_id/{user_id}/", response_model=List[TransactionResponse])
+async def get_transactions_by_user(user_id: int, response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        transactions = await get_transaction_list(db_h, response, limit, cursor, sort_key, descending, user_id=user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
+    
     if transactions is None:
         raise HTTPException(status_code=404, detail="No transactions found")
 
     return transactions
 
-@app.get("/get_transactions_by_user_name/{user_name}/")
-async def get_transactions_by_user(user_name: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            user = await db_h.get_by(User, username=user_name)
-            if user is None:
-                raise HTTPException(status_code=404, detail="User not found")
-            transactions = await db_h.get_all_by(Transaction, user_id=user.id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
-        
+@app.get("/get_transactions_by_user_name/{user_name}/", response_model=List[TransactionResponse])
+async def get_transactions_by_user(user_name: str, response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        user = await db_h.get_by(User, username=user_name)
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        transactions = await get_transaction_list(db_h, response, limit, cursor, sort_key, descending, user_id=user.id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
+    
     if transactions is None:
         raise HTTPException(status_code=404, detail="No transactions found")
 
     return transactions
 
-@app.get("/get_transactions_by_product_id/{product_id}/")
-async def get_transactions_by_product(product_id: int):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            transactions = await db_h.get_all_by(Transaction, product_id=product_id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
-        
+@app.get("/get_transactions_by_product_id/{product_id}/", response_model=List[TransactionResponse])
+async def get_transactions_by_product(product_id: int, response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        transactions = await get_transaction_list(db_h, response, limit, cursor, sort_key, descending, product_id=product_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
+    
     if transactions is None:
         raise HTTPException(status_code=404, detail="No transactions found")
     
     return transactions
 
-@app.get("/get_transactions_by_product_name/{product_name}/")
-async def get_transactions_by_product(product_name: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            product = await db_h.get_by(Product, name=product_name)
-            if product is None:
-                raise HTTPException(status_code=404, detail="Product not found")
-            transactions = await db_h.get_all_by(Transaction, product_id=product.id)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
-        
+@app.get("/get_transactions_by_product_name/{product_name}/", response_model=List[TransactionResponse])
+async def get_transactions_by_product(product_name: str, response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        product = await db_h.get_by(Product, name=product_name)
+        if product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        transactions = await get_transaction_list(db_h, response, limit, cursor, sort_key, descending, product_id=product.id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
+    
     if transactions is None:
         raise HTTPException(status_code=404, detail="No transactions found")
 
     return transactions
-@app.get("/get_transactions_by_transaction_type/{transaction_type}/")
-async def get_transactions_by_transaction_type(transaction_type: str):
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            transactions = await db_h.get_all_by(Transaction, transaction_type=transaction_type)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
-        
+@app.get("/get_transactions_by_transaction_type/{transaction_type}/", response_model=List[TransactionResponse])
+async def get_transactions_by_transaction_type(transaction_type: str, response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        transactions = await get_transaction_list(db_h, response, limit, cursor, sort_key, descending, transaction_type=transaction_type)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
+    
     if transactions is None:
         raise HTTPException(status_code=404, detail="No transactions found")
 
     return transactions
 
-@app.get("/get_transactions/")
-async def get_transactions():
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            transactions = await db_h.get_all(Transaction)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
-        
+@app.get("/get_transactions/", response_model=List[TransactionResponse])
+async def get_transactions(response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        transactions = await get_transaction_list(db_h, response, limit, cursor, sort_key, descending)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get transactions: {e}")
+    
     if transactions is None:
         raise HTTPException(status_code=404, detail="No transactions found")
 
@@ -602,19 +667,257 @@ async def get_transactions():
 
 #get logs
 @app.get("/get_logs/")
-async def get_logs():
-    async with AsyncDatabaseHandler() as db_h:
-        try:
-            logs = await db_h.get_all(Log)
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Failed to get logs: {e}")
-        
+async def get_logs(response: Response, db_h: ReadOnlyHandler, limit: Optional[int] = None, cursor: Optional[str] = None, sort_key: str = "id", descending: bool = False):
+    try:
+        logs = await get_list(db_h, response, Log, limit, cursor, sort_key, descending)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get logs: {e}")
+    
     if logs is None:
         raise HTTPException(status_code=404, detail="No logs found")
 
     return logs
 
+@app.get("/get_log_retention_stats/")
+async def get_log_retention_stats():
+    return log_retention.stats
+
+# Bulk imports
+# The body is a JSON array or NDJSON (Content-Type: application/x-ndjson), one object per item.
+# Every item gets a result, items that fail validation are reported without failing the batch.
+async def read_bulk_items(request, schema, results):
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            raw_items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            raw_items = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bulk body: {e}")
+    if not isinstance(raw_items, list):
+        raise HTTPException(status_code=400, detail="Bulk body must be a JSON array or NDJSON")
+
+    items = []
+    for index, raw_item in enumerate(raw_items):
+        try:
+            items.append((index, schema.parse_obj(raw_item).dict()))
+        except ValidationError as e:
+            results.failed(index, "; ".join(f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}" for error in e.errors()))
+    return items
+
+async def bulk_create(request, db_h, schema, create_method):
+    results = BulkResults()
+    items = await read_bulk_items(request, schema, results)
+    try:
+        await getattr(BulkService(db_h), create_method)(items, results)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to bulk create: {e}")
+    return results.response()
+
+@app.post("/bulk/users")
+async def bulk_users(request: Request, db_h: UserHandler):
+    return await bulk_create(request, db_h, UserBase, "create_users")
+
+@app.post("/bulk/categories")
+async def bulk_categories(request: Request, db_h: CategoryHandler):
+    return await bulk_create(request, db_h, CategoryBase, "create_categories")
+
+@app.post("/bulk/products")
+async def bulk_products(request: Request, db_h: ProductHandler):
+    return await bulk_create(request, db_h, ProductBase, "create_products")
+
+@app.post("/bulk/transactions")
+async def bulk_transactions(request: Request, db_h: TransactionHandler):
+    return await bulk_create(request, db_h, TransactionBase, "create_transactions")
+
+# Exports
+def date_range_condition(model, date_from, date_to):
+    conditions = []
+    if date_from is not None:
+        conditions.append(model.date >= date_from)
+    if date_to is not None:
+        conditions.append(model.date <= date_to)
+    return and_(*conditions) if conditions else None
+
+def export_response(model, export_format, condition, filename, **filters):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid export format, allowed formats are {list(EXPORT_FORMATS)}")
+
+    # The handler lives inside the generator so the session stays open while the rows stream out
+    async def stream():
+        async with AsyncDatabaseHandler(readonly=True) as db_h:
+            rows = db_h.stream_rows(model, condition, **filters)
+            async for chunk in export_lines(rows, export_format, model.__table__.columns.keys()):
+                yield chunk
+
+    return StreamingResponse(
+        stream(),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{export_format}"},
+    )
+
+@app.get("/export/transactions")
+async def export_transactions(
+    db_h: ReadOnlyHandler,
+    format: str = "ndjson",
+    user_id: Optional[int] = None,
+    user_name: Optional[str] = None,
+    product_id: Optional[int] = None,
+    product_name: Optional[str] = None,
+    transaction_type: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    filters = {}
+    if user_name is not None or product_name is not None:
+        try:
+            if user_name is not None:
+                user = await db_h.get_by(User, username=user_name)
+                if user is None:
+                    raise HTTPException(status_code=404, detail="User not found")
+                user_id = user.id
+            if product_name is not None:
+                product = await db_h.get_by(Product, name=product_name)
+                if product is None:
+                    raise HTTPException(status_code=404, detail="Product not found")
+                product_id = product.id
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to export transactions: {e}")
+    if user_id is not None:
+        filters["user_id"] = user_id
+    if product_id is not None:
+        filters["product_id"] = product_id
+    if transaction_type is not None:
+        filters["transaction_type"] = transaction_type
+
+    condition = date_range_condition(Transaction, date_from, date_to)
+    return export_response(Transaction, format, condition, "transactions", **filters)
+
+@app.get("/export/logs")
+async def export_logs(
+    format: str = "ndjson",
+    status: Optional[str] = None,
+    func: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    filters = {}
+    if status is not None:
+        filters["status"] = status
+    if func is not None:
+        filters["func"] = func
+
+    condition = date_range_condition(Log, date_from, date_to)
+    return export_response(Log, format, condition, "logs", **filters)
+
+# Currency rates, a new rate applies to transactions from its effective_from on
+@app.post("/create_currency_rate/", response_model=CurrencyRateResponse)
+async def create_currency_rate(currency_rate: CurrencyRateBase, db_h: CurrencyRateHandler):
+    try:
+        currency_rate = await db_h.create(
+            currency=currency_rate.currency,
+            rate=currency_rate.rate,
+            effective_from=currency_rate.effective_from.isoformat() if currency_rate.effective_from else None
+        )
+        await db_h.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to create currency rate: {e}")
+    return CurrencyRateResponse(id=currency_rate.id, currency=currency_rate.currency, rate=currency_rate.rate, effective_from=currency_rate.effective_from)
+
+@app.get("/get_currency_rates/", response_model=List[CurrencyRateResponse])
+async def get_currency_rates(db_h: ReadOnlyHandler, currency: Optional[str] = None):
+    filters = {}
+    if currency is not None:
+        filters["currency"] = currency.lower()
+    try:
+        currency_rates = await db_h.get_all_by(CurrencyRate, **filters)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get currency rates: {e}")
+    return [CurrencyRateResponse(id=rate.id, currency=rate.currency, rate=rate.rate, effective_from=rate.effective_from) for rate in currency_rates]
+
+# Reports, grouped and summed by the database and converted to one currency
+# Leaderboards are declared before /reports/{report} so "top" isn't taken for a report name
+@app.get("/reports/top", response_model=TopResponse)
+async def get_top_report(
+    db_h: ReadOnlyHandler,
+    metric: str = "revenue",
+    dimension: str = "product",
+    period: str = "month",
+    n: int = 10,
+    currency: str = "usd",
+):
+    try:
+        rows = await db_h.get_top_report(metric, dimension, period, n, currency)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get top report: {e}")
+    return TopResponse(metric=metric, dimension=dimension, period=period, currency=currency.lower(), rows=rows)
+
+@app.get("/reports/{report}", response_model=ReportResponse)
+async def get_report(
+    report: str,
+    db_h: ReadOnlyHandler,
+    currency: str = "usd",
+    period: Optional[str] = None,
+    group_by: Optional[str] = None,
+    user_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    filters = {}
+    if user_id is not None:
+        filters["user_id"] = user_id
+    if product_id is not None:
+        filters["product_id"] = product_id
+    try:
+        rows = await db_h.get_report(report, currency, period, group_by, date_from, date_to, **filters)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get report: {e}")
+    return ReportResponse(
+        report=report,
+        currency=currency.lower(),
+        period=period,
+        group_by=parse_group_by(group_by),
+        count=sum(row["count"] for row in rows),
+        quantity=sum(row["quantity"] for row in rows),
+        amount=sum(row["amount"] for row in rows),
+        rows=rows
+    )
+
+# Activity, read from rollups kept up to date by every transaction write
+@app.get("/activity/user/{user_id}", response_model=ActivityResponse)
+async def get_user_activity(user_id: int, db_h: ReadOnlyHandler, currency: str = "usd"):
+    try:
+        user = await db_h.get_by(User, id=user_id)
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        activity = await db_h.get_user_activity(user_id, currency)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get user activity: {e}")
+    return ActivityResponse(id=user_id, **activity)
+
+@app.get("/activity/product/{product_id}", response_model=ActivityResponse)
+async def get_product_activity(product_id: int, db_h: ReadOnlyHandler, currency: str = "usd"):
+    try:
+        product = await db_h.get_by(Product, id=product_id)
+        if product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        activity = await db_h.get_product_activity(product_id, currency)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to get product activity: {e}")
+    return ActivityResponse(id=product_id, **activity)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="localhost", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="localhost", port=8000)
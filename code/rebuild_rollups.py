@@ -0,0 +1,50 @@
+import sys
+sys.path.append("database")
+from db_connect import AsyncDatabaseConnect
+from db_rollups import rebuild_rollups, backfill_base_price
+from db_schema import upgrade_schema
+from db_currency import currency_rates
+import asyncio
+import time
+
+#python rebuild_rollups.py [schema|base_price|rollups] [chunk_size]
+# schema adds the tables, columns and indexes the models gained to an existing database,
+# run it before starting a new API version on it. It only adds, running it again is a no-op.
+# Backfills and rebuilds the derived transaction data, one chunk per DB transaction.
+# base_price and rollups are safe to run next to the API. rollups replaces the rollup rows
+# of a range of days (or product and user ids) at once, locking that range's transactions
+# meanwhile, so writes to it wait for the chunk and reports never see it half rebuilt.
+# Without a name everything runs in order, base_price before rollups so the rebuilt rollups pick it up.
+
+# Step name -> (function, what the count it returns is of)
+STEPS = {
+    'schema': (upgrade_schema, 'schema changes'),
+    'base_price': (backfill_base_price, 'transactions'),
+    'rollups': (rebuild_rollups, 'transactions'),
+}
+
+async def main(names, chunk_size=None):
+    await AsyncDatabaseConnect.init_engine()
+    try:
+        rates_loaded = False
+        for name in names:
+            # base_price and rollups convert at the rates of each transaction's date. Loaded
+            # after schema, which creates currency_rates on a database that doesn't have it yet
+            if name != 'schema' and not rates_loaded:
+                async with AsyncDatabaseConnect.shared_sessionmaker() as session:
+                    await currency_rates.load(session)
+                rates_loaded = True
+            started = time.perf_counter()
+            step, unit = STEPS[name]
+            count = await step(AsyncDatabaseConnect.shared_sessionmaker, chunk_size)
+            print(f"{name:<14} {count} {unit} in {time.perf_counter() - started:.1f} s")
+    finally:
+        await AsyncDatabaseConnect.dispose_engine()
+
+if __name__ == "__main__":
+    names = [arg for arg in sys.argv[1:] if not arg.isdigit()] or list(STEPS)
+    for name in names:
+        if name not in STEPS:
+            sys.exit(f"Unknown step '{name}', allowed steps are {list(STEPS)}")
+    chunk_sizes = [int(arg) for arg in sys.argv[1:] if arg.isdigit()]
+    asyncio.run(main(names, chunk_sizes[0] if chunk_sizes else None))
@@ -2,14 +2,28 @@ import unittest
 
 import sys
 sys.path.append("database")
-from database.db_handler_async import AsyncDatabaseHandler
+from database.db_handler_async import AsyncDatabaseHandler, BulkService, BulkResults, apply_transaction_batch, encode_cursor
 from database.db_classes import *
+from db_sentinels import sentinels
+from db_group_commit import group_commit
+from db_rollups import rebuild_rollups, backfill_base_price
+from db_schema import upgrade_schema
+from db_currency import to_base, CurrencyRates, currency_rates
+from db_settings import get_settings, SettingsLoader, SETTINGS_FILES, data_dir
+from db_category_tree import CategoryTree
+from db_services_async import AsyncLogRetentionService
+from datetime import datetime
 
 from faker import Faker as fk
 from werkzeug.security import check_password_hash
 from sqlalchemy import desc, func, select, text
 import logging
+import asyncio
 import os
+import json
+import shutil
+import tempfile
+import types
 #python -m unittest -v test_async.py
 
 logging.basicConfig(level=logging.ERROR)
@@ -22,6 +36,8 @@ class CleanDatabase():
 
     async def clean(self):
         await self.session.run_sync(self._drop_and_create_all)
+        # Cached sentinel ids point at rows that no longer exist
+        sentinels.clear()
 
     def _drop_and_create_all(self, sync_session):
         Base.metadata.drop_all(self.engine)
@@ -97,6 +113,98 @@ class TestAsyncDatabaseHandler(unittest.IsolatedAsyncioTestCase):
                 self.fail("Failed to create transaction")
         self.assertIsNotNone(queried_transaction)
 
+    async def test_create_transaction_not_enough_stock(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(
+                    name="test_not_enough_stock",
+                    description="test description",
+                    purchase_price=1.0,
+                    restock_price=1.0,
+                    currency="USD",
+                    quantity=2
+                )
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(
+                    username="test_not_enough_stock",
+                    password="testpassword",
+                    email="test_not_enough_stock@test.com"
+                )
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        with self.assertRaises(ValueError):
+            async with AsyncDatabaseHandler("Transaction") as db_h:
+                await db_h.create(
+                    product_id=product.id,
+                    user_id=user.id,
+                    transaction_type="purchase",
+                    quantity=3,
+                    currency="USD",
+                )
+        async with AsyncDatabaseHandler() as db_h:
+            queried_product = await db_h.get_by(Product, id=product.id)
+        self.assertEqual(queried_product.quantity, 2)
+
+    async def test_create_transaction_zero_quantity(self):
+        # Rejected before the product is looked up, nothing is written
+        with self.assertRaises(ValueError):
+            async with AsyncDatabaseHandler("Transaction") as db_h:
+                await db_h.create(product_id=1, user_id=1, transaction_type="purchase", quantity=0, currency="USD")
+
+    async def test_delete_product_reassigns_transactions(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(
+                    name="test_delete_reassign",
+                    description="test description",
+                    purchase_price=1.0,
+                    restock_price=1.0,
+                    currency="USD",
+                    quantity=10
+                )
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(
+                    username="test_delete_reassign",
+                    password="testpassword",
+                    email="test_delete_reassign@test.com"
+                )
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                for _ in range(5):
+                    await db_h.create(
+                        product_id=product.id,
+                        user_id=user.id,
+                        transaction_type="purchase",
+                        quantity=1,
+                        currency="USD",
+                    )
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create transactions")
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                await db_h.delete_by_id(Product, product.id, chunk_size=2)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to delete product")
+        async with AsyncDatabaseHandler() as db_h:
+            remaining = await db_h.get_all_by(Transaction, product_id=product.id)
+            reassigned = await db_h.get_all_by(Transaction, user_id=user.id)
+        self.assertEqual(remaining, [])
+        self.assertEqual(len(reassigned), 5)
+
     async def test_multiple_sessions(self):
         fake = fk()
         async with AsyncDatabaseHandler("User") as db_h:
@@ -209,6 +317,503 @@ class TestAsyncDatabaseHandler(unittest.IsolatedAsyncioTestCase):
         else:
             self.fail("No log entry found")
 
+    async def test_rolled_back_write_logs_no_ok(self):
+        try:
+            async with AsyncDatabaseHandler("Category") as db_h:
+                await db_h.create(name="test_rolled_back_log")
+                # Fails after the service returned, before the handler commits
+                raise RuntimeError("request failed")
+        except RuntimeError:
+            pass
+
+        async with AsyncDatabaseHandler() as db_h:
+            category = await db_h.get_by(Category, name="test_rolled_back_log")
+            queried_log = await db_h.get_by_contains(Log, kwargs="test_rolled_back_log")
+        self.assertIsNone(category)
+        self.assertIsNone(queried_log)
+
+    async def test_get_page(self):
+        async with AsyncDatabaseHandler("Category") as db_h:
+            try:
+                for i in range(5):
+                    await db_h.create(name=f"test_get_page_{i}")
+                condition = Category.name.startswith("test_get_page_")
+                first_page, cursor = await db_h.get_page(Category, limit=3, sort_key="name", condition=condition)
+                second_page, last_cursor = await db_h.get_page(Category, limit=3, cursor=cursor, condition=condition)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to page categories")
+        names = [category.name for category in first_page + second_page]
+        self.assertEqual(names, [f"test_get_page_{i}" for i in range(5)])
+        self.assertIsNone(last_cursor)
+
+    async def test_get_page_rejects_unlisted_sort_keys(self):
+        async with AsyncDatabaseHandler() as db_h:
+            with self.assertRaises(ValueError):
+                await db_h.get_page(User, limit=1, sort_key="password")
+            # A crafted cursor can't pick the column either
+            with self.assertRaises(ValueError):
+                await db_h.get_page(User, limit=1, cursor=encode_cursor("password", False, "", 0))
+
+    async def test_get_products_in_category_subtree(self):
+        async with AsyncDatabaseHandler("Category") as db_h:
+            try:
+                await db_h.create(name="test_subtree_root")
+                await db_h.create(name="test_subtree_child", parent_name="test_subtree_root")
+                await db_h.create(name="test_subtree_grandchild", parent_name="test_subtree_child")
+                root = await db_h.get_by(Category, name="test_subtree_root")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create categories")
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                for category_name in ["test_subtree_root", "test_subtree_child", "test_subtree_grandchild"]:
+                    await db_h.create(
+                        name=f"{category_name}_product",
+                        description="test description",
+                        purchase_price=1.0,
+                        restock_price=1.0,
+                        currency="USD",
+                        quantity=1,
+                        category_name=category_name
+                    )
+                all_products = await db_h.get_products_in_category_subtree(root.id)
+                top_products = await db_h.get_products_in_category_subtree(root.id, max_depth=1)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to get products in subtree")
+        self.assertEqual(len(all_products), 3)
+        self.assertEqual(len(top_products), 2)
+
+    async def test_group_commit_transactions(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_group_commit", description=None, purchase_price=1.0, restock_price=1.0, currency="USD", quantity=2)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_group_commit", password="testpassword", email="test_group_commit@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        kwargs = dict(product_id=product.id, user_id=user.id, transaction_type="purchase", currency="USD")
+        await group_commit.start(apply_transaction_batch, enabled=True)
+        try:
+            # The second call oversells and fails on its own, the other two still commit
+            results = await asyncio.gather(
+                group_commit.submit(quantity=1, **kwargs),
+                group_commit.submit(quantity=5, **kwargs),
+                group_commit.submit(quantity=1, **kwargs),
+                return_exceptions=True
+            )
+        finally:
+            await group_commit.stop()
+        self.assertIsInstance(results[1], ValueError)
+        # After stop() a call is refused instead of waiting for a batch that never comes
+        with self.assertRaises(RuntimeError):
+            await group_commit.submit(quantity=1, **kwargs)
+        async with AsyncDatabaseHandler() as db_h:
+            queried_product = await db_h.get_by(Product, id=product.id)
+            transactions = await db_h.get_all_by(Transaction, product_id=product.id)
+        self.assertEqual(queried_product.quantity, 0)
+        self.assertEqual(sorted(transaction.id for transaction in transactions), sorted([results[0].id, results[2].id]))
+
+    async def test_checkout(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                first = await db_h.create(name="test_checkout_0", description=None, purchase_price=2.0, restock_price=1.0, currency="USD", quantity=5)
+                second = await db_h.create(name="test_checkout_1", description=None, purchase_price=3.0, restock_price=1.0, currency="USD", quantity=5)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create products")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_checkout", password="testpassword", email="test_checkout@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        lines = [{"product_id": first.id, "quantity": 2}, {"product_id": second.id, "quantity": 1}, {"product_id": first.id, "quantity": 1}]
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                transactions = await db_h.checkout(user_id=user.id, currency="USD", lines=lines)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to checkout")
+        self.assertEqual([transaction["price"] for transaction in transactions], [4.0, 3.0, 2.0])
+        async with AsyncDatabaseHandler() as db_h:
+            queried_first = await db_h.get_by(Product, id=first.id)
+            queried_second = await db_h.get_by(Product, id=second.id)
+            queried_transaction = await db_h.get_by(Transaction, id=transactions[1]["id"])
+        self.assertEqual(queried_first.quantity, 2)
+        self.assertEqual(queried_second.quantity, 4)
+        self.assertEqual(queried_transaction.product_id, second.id)
+
+    async def test_report_by_type(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_report", description=None, purchase_price=2.0, restock_price=1.0, currency="USD", quantity=10)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_report", password="testpassword", email="test_report@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                for transaction_type, quantity, currency in [("purchase", 2, "USD"), ("purchase", 1, "EUR"), ("restock", 4, "USD")]:
+                    await db_h.create(product_id=product.id, user_id=user.id, transaction_type=transaction_type, quantity=quantity, currency=currency)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create transactions")
+        async with AsyncDatabaseHandler(readonly=True) as db_h:
+            rows = await db_h.get_report("income", "usd", group_by="type", product_id=product.id)
+        self.assertEqual([(row["transaction_type"], row["count"], row["quantity"]) for row in rows], [("purchase", 2, 3), ("restock", 1, 4)])
+        self.assertAlmostEqual(rows[0]["amount"], 6.0)
+        self.assertAlmostEqual(rows[1]["amount"], -4.0)
+
+    async def test_transaction_base_price(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_base_price", description=None, purchase_price=2.0, restock_price=1.0, currency="EUR", quantity=10)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_base_price", password="testpassword", email="test_base_price@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                transaction = await db_h.create(product_id=product.id, user_id=user.id, transaction_type="purchase", quantity=3, currency="DKK")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create transaction")
+        # 6 EUR charged in DKK, stored once more in the base currency
+        self.assertAlmostEqual(transaction.base_price, to_base(6.0, "eur"))
+
+    async def test_transaction_base_price_backfill(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_backfill_base_price", description=None, purchase_price=2.0, restock_price=1.0, currency="EUR", quantity=10)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_backfill_base_price", password="testpassword", email="test_backfill_base_price@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                for currency in ["DKK", "USD", "EUR"]:
+                    await db_h.create(product_id=product.id, user_id=user.id, transaction_type="purchase", quantity=1, currency=currency)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create transactions")
+        # Rows written before base_price existed
+        async with AsyncDatabaseHandler() as db_h:
+            await db_h.session.execute(text("UPDATE transactions SET base_price = NULL WHERE product_id = :product_id"), {"product_id": product.id})
+            await db_h.session.commit()
+            self.assertEqual(await backfill_base_price(db_h.db_connect.sessionmaker, chunk_size=2), 3)
+            rows = (await db_h.session.execute(select(Transaction).where(Transaction.product_id == product.id))).scalars().all()
+        self.assertEqual(len(rows), 3)
+        for row in rows:
+            self.assertAlmostEqual(row.base_price, to_base(row.price, row.currency, currency_rates.rates_at(row.date)))
+
+    async def test_currency_rate_versions(self):
+        async with AsyncDatabaseHandler("CurrencyRate") as db_h:
+            try:
+                await db_h.create(currency="GBP", rate=0.5, effective_from="2020-01-01T00:00:00")
+                await db_h.create(currency="GBP", rate=0.6, effective_from="2021-01-01T00:00:00")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create currency rates")
+        # A cache of its own, the shared one would reprice the other tests
+        rates = CurrencyRates()
+        async with AsyncDatabaseHandler() as db_h:
+            await rates.load(db_h.session)
+        self.assertEqual(rates.rate("gbp", datetime(2020, 6, 1)), 0.5)
+        self.assertEqual(rates.rate("gbp", datetime(2021, 1, 1)), 0.6)
+        self.assertEqual(rates.rate("gbp", datetime(2019, 1, 1)), get_settings().conversion_rates["gbp"])
+        self.assertEqual(rates.rate("usd", datetime(2021, 1, 1)), get_settings().conversion_rates["usd"])
+
+    async def test_daily_summary_matches_rebuild(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_daily_summary", description=None, purchase_price=2.0, restock_price=1.0, currency="USD", quantity=10)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_daily_summary", password="testpassword", email="test_daily_summary@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                for quantity in [1, 2, 3]:
+                    transaction = await db_h.create(product_id=product.id, user_id=user.id, transaction_type="purchase", quantity=quantity, currency="USD")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create transactions")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            await db_h.delete_by_id(Transaction, transaction.id)
+
+        async def summary():
+            async with AsyncDatabaseHandler() as db_h:
+                rows = await db_h.get_all_by(TransactionDailySummary, product_id=product.id)
+            return [(row.day, row.transaction_type, row.currency, row.count, row.quantity, row.price) for row in rows]
+
+        maintained = await summary()
+        self.assertEqual([row[3:] for row in maintained], [(2, 3, 6.0)])
+        async with AsyncDatabaseHandler() as db_h:
+            await rebuild_rollups(db_h.db_connect.sessionmaker, chunk_size=2)
+        self.assertEqual(await summary(), maintained)
+
+    async def test_upgrade_schema_adds_missing_parts(self):
+        # An older database: no daily activity table, no base_price index
+        index = next(index for index in Transaction.__table__.indexes if index.name == "ix_transactions_type_date_base_price")
+        async with AsyncDatabaseHandler() as db_h:
+            await db_h.session.run_sync(lambda sync_session: (UserDailyActivity.__table__.drop(sync_session.connection()), index.drop(sync_session.connection())))
+            await db_h.session.commit()
+            self.assertEqual(await upgrade_schema(db_h.db_connect.sessionmaker), 2)
+            # Running it again finds nothing to add
+            self.assertEqual(await upgrade_schema(db_h.db_connect.sessionmaker), 0)
+
+    async def test_user_and_product_activity(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_activity", description=None, purchase_price=2.0, restock_price=1.0, currency="USD", quantity=10)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_activity", password="testpassword", email="test_activity@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                for quantity in [1, 2, 3]:
+                    transaction = await db_h.create(product_id=product.id, user_id=user.id, transaction_type="purchase", quantity=quantity, currency="USD")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create transactions")
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            await db_h.delete_by_id(Transaction, transaction.id)
+
+        async with AsyncDatabaseHandler() as db_h:
+            user_activity = await db_h.get_user_activity(user.id, "usd")
+            product_activity = await db_h.get_product_activity(product.id, "usd")
+        expected = {"purchase": {"count": 2, "quantity": 3, "amount": 6.0}}
+        for activity in [user_activity, product_activity]:
+            self.assertEqual(activity["lifetime"], expected)
+            self.assertEqual(activity["last_7_days"], expected)
+            self.assertEqual(activity["last_30_days"], expected)
+            self.assertIsNotNone(activity["last_activity"])
+
+    async def test_top_report_follows_new_transactions(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_top_report", description=None, purchase_price=2.0, restock_price=1.0, currency="USD", quantity=10)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_top_report", password="testpassword", email="test_top_report@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+
+        async def top_row():
+            async with AsyncDatabaseHandler() as db_h:
+                rows = await db_h.get_top_report("quantity", "product", "month", get_settings().top_report_size, "usd")
+            return next((row for row in rows if row["id"] == product.id), None)
+
+        for quantity in [2, 3]:
+            async with AsyncDatabaseHandler("Transaction") as db_h:
+                try:
+                    await db_h.create(product_id=product.id, user_id=user.id, transaction_type="purchase", quantity=quantity, currency="USD")
+                except Exception as e:
+                    logging.error(e)
+                    self.fail("Failed to create transaction")
+            # The second read would come from the cache if the new transaction hadn't dropped it
+            row = await top_row()
+        self.assertEqual((row["name"], row["quantity"], row["amount"]), ("test_top_report", 5, 10.0))
+
+    async def test_bulk_create_products(self):
+        async with AsyncDatabaseHandler("Category") as db_h:
+            try:
+                await db_h.create(name="test_bulk_category")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create category")
+        items = [
+            (0, {"name": "test_bulk_0", "description": None, "category_name": "test_bulk_category", "purchase_price": 1.0, "restock_price": 1.0, "currency": "USD", "quantity": 1}),
+            (1, {"name": "test_bulk_1", "description": None, "category_name": None, "purchase_price": 1.0, "restock_price": 1.0, "currency": "USD", "quantity": 1}),
+            (2, {"name": "test_bulk_0", "description": None, "category_name": None, "purchase_price": 1.0, "restock_price": 1.0, "currency": "USD", "quantity": 1}),
+            (3, {"name": "test_bulk_3", "description": None, "category_name": None, "purchase_price": -1.0, "restock_price": 1.0, "currency": "USD", "quantity": 1}),
+        ]
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                results = await BulkService(db_h).create_products(items, BulkResults())
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to bulk create products")
+        response = results.response()
+        self.assertEqual(response["created"], 2)
+        self.assertEqual([result["status"] for result in response["results"]], ["created", "created", "failed", "failed"])
+        async with AsyncDatabaseHandler() as db_h:
+            product = await db_h.get_by(Product, name="test_bulk_0")
+            category = await db_h.get_by(Category, name="test_bulk_category")
+        self.assertEqual(product.id, response["results"][0]["id"])
+        self.assertEqual(product.category_id, category.id)
+
+    async def test_bulk_create_transactions_upper_case_currency(self):
+        async with AsyncDatabaseHandler("Product") as db_h:
+            try:
+                product = await db_h.create(name="test_bulk_transactions", description=None, purchase_price=2.0, restock_price=1.0, currency="USD", quantity=10)
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create product")
+        async with AsyncDatabaseHandler("User") as db_h:
+            try:
+                user = await db_h.create(username="test_bulk_transactions", password="testpassword", email="test_bulk_transactions@test.com")
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to create user")
+        items = [
+            (0, {"product_id": product.id, "user_id": user.id, "transaction_type": "purchase", "quantity": 1, "currency": "USD"}),
+            (1, {"product_id": product.id, "user_id": user.id, "transaction_type": "purchase", "quantity": 2, "currency": "usd"}),
+        ]
+        async with AsyncDatabaseHandler("Transaction") as db_h:
+            try:
+                results = await BulkService(db_h).create_transactions(items, BulkResults())
+            except Exception as e:
+                logging.error(e)
+                self.fail("Failed to bulk create transactions")
+        response = results.response()
+        self.assertEqual(response["created"], 2)
+        async with AsyncDatabaseHandler() as db_h:
+            transaction = await db_h.get_by(Transaction, id=response["results"][0]["id"])
+        self.assertEqual(transaction.currency, "usd")
+
+    async def test_settings_reload(self):
+        # A copy of the data folder, the real files stay untouched
+        with tempfile.TemporaryDirectory() as directory:
+            for name in SETTINGS_FILES.values():
+                if os.path.exists(os.path.join(data_dir, name)):
+                    shutil.copy(os.path.join(data_dir, name), directory)
+            loader = SettingsLoader(directory)
+            self.assertEqual(loader.get().bulk_chunk_size, get_settings().bulk_chunk_size)
+            self.assertFalse(loader.refresh())
+
+            config_path = os.path.join(directory, SETTINGS_FILES['config'])
+            with open(config_path) as f:
+                config = json.load(f)
+            config['bulk_chunk_size'] = 7
+            with open(config_path, 'w') as f:
+                json.dump(config, f)
+            os.utime(config_path, ns=(0, 0))
+            self.assertTrue(loader.refresh())
+            self.assertEqual(loader.get().bulk_chunk_size, 7)
+
+            # Mid save-by-rename the file is briefly gone, the old settings stay
+            os.remove(config_path)
+            self.assertFalse(loader.refresh())
+            self.assertEqual(loader.get().bulk_chunk_size, 7)
+
+    async def test_category_tree_build(self):
+        tree = CategoryTree()
+        rows = [
+            {"id": 1, "name": "root", "description": None, "parent_id": None},
+            {"id": 2, "name": "child", "description": None, "parent_id": 1},
+            {"id": 3, "name": "grandchild", "description": None, "parent_id": 2},
+            # Its own parent, and a parent that doesn't exist, both count as top-level
+            {"id": 4, "name": "self_parent", "description": None, "parent_id": 4},
+            {"id": 5, "name": "orphan", "description": None, "parent_id": 99},
+            # A cycle is never reached from a top-level category, building still finishes
+            {"id": 6, "name": "cycle_a", "description": None, "parent_id": 7},
+            {"id": 7, "name": "cycle_b", "description": None, "parent_id": 6},
+        ]
+        tree.build(rows)
+        self.assertEqual([row["id"] for row in tree.path(3)], [1, 2, 3])
+        self.assertEqual([row["id"] for row in tree.path(4)], [4])
+        self.assertEqual([row["id"] for row in tree.path(5)], [5])
+        self.assertEqual(tree.subtree_ids(1), {1, 2, 3})
+        self.assertEqual(tree.subtree_ids(4), {4})
+        self.assertEqual(tree.path(6), [])
+        self.assertEqual(tree.subtree_ids(6), {6})
+        self.assertEqual(tree.subtree_ids(99), frozenset())
+        self.assertEqual([row["id"] for row in tree.subcategories(1)], [2])
+
+    async def test_category_tree_invalidated_during_load(self):
+        tree = CategoryTree()
+        rows = [{"id": 1, "name": "root", "description": None, "parent_id": None}]
+
+        class Session:
+            def __init__(self, concurrent_write):
+                self.concurrent_write = concurrent_write
+
+            async def execute(self, stmt):
+                if self.concurrent_write:
+                    # A category write commits while the rows are being read
+                    tree.invalidate()
+                return types.SimpleNamespace(mappings=lambda: rows)
+
+        await tree.load(Session(concurrent_write=True))
+        self.assertEqual(tree.get(1)["name"], "root")
+        # The rows may predate that write, the next read loads again
+        self.assertFalse(tree.loaded)
+        await tree.ensure_loaded(Session(concurrent_write=False))
+        self.assertTrue(tree.loaded)
+
+    async def test_log_retention_watermark_and_interval(self):
+        retention = AsyncLogRetentionService()
+
+        class Connection:
+            def __init__(self, values):
+                self.values = list(values)
+
+            async def scalar(self, stmt):
+                return self.values.pop(0)
+
+        # Row-count limit says 40, age says everything up to 59, the higher one wins
+        settings = types.SimpleNamespace(log_limit=100, log_max_age_days=30)
+        self.assertEqual(await retention.find_watermark(Connection([40, 60]), settings), 59)
+        # No row young enough to keep, everything up to the max id goes
+        settings = types.SimpleNamespace(log_limit=0, log_max_age_days=30)
+        self.assertEqual(await retention.find_watermark(Connection([None, 81]), settings), 80)
+        # Fewer rows than the limit, nothing to prune
+        settings = types.SimpleNamespace(log_limit=100, log_max_age_days=0)
+        self.assertIsNone(await retention.find_watermark(Connection([None]), settings))
+
+        settings = types.SimpleNamespace(log_retention_chunk_size=1000, log_retention_min_interval=5, log_retention_max_interval=600)
+        retention.interval = 60
+        # The first run only records where the ids are
+        retention.adapt_interval(0, 0.0, settings)
+        self.assertEqual(retention.interval, 60)
+        # 100 new rows a second, a chunk every 10 seconds
+        retention.adapt_interval(1000, 10.0, settings)
+        self.assertEqual(retention.interval, 10)
+        # No new rows, the longest interval
+        retention.adapt_interval(1000, 20.0, settings)
+        self.assertEqual(retention.interval, 600)
+        # A flood is held to the shortest interval
+        retention.adapt_interval(1001000, 30.0, settings)
+        self.assertEqual(retention.interval, 5)
+
     async def test_clean_database(self):
        async with AsyncDatabaseHandler("User") as db_h:
            cleaner = CleanDatabase(db_h.session)